@@ -15,7 +15,7 @@ from shared_code.processors.document_intelligence_processor import DocumentIntel
 from shared_code.processors.chunking_processor import ChunkingProcessor
 from shared_code.processors.openai_batch_processor import OpenAIBatchProcessor
 from shared_code.utils.app_insights_logger import get_logger, generate_operation_id
-from shared_code.utils.blob_storage_client import BlobStorageClient
+from shared_code.utils.blob_storage_client import get_blob_storage_client
 
 # Utilidad local para cargar local.settings.json en entorno local
 def _load_local_settings_env():
@@ -26,6 +26,9 @@ def _load_local_settings_env():
                    os.environ.get('WEBSITE_SITE_NAME') is not None
         if in_azure:
             return
+        # Ya cargado en este proceso (por otra función o una importación anterior)
+        if os.environ.get('_LOCAL_SETTINGS_LOADED') == '1':
+            return
         settings_path = Path(__file__).parent.parent / 'local.settings.json'
         if not settings_path.exists():
             return
@@ -35,6 +38,7 @@ def _load_local_settings_env():
         for k, v in values.items():
             if isinstance(v, str):
                 os.environ[k] = v
+        os.environ['_LOCAL_SETTINGS_LOADED'] = '1'
     except Exception:
         pass
 
@@ -102,7 +106,7 @@ def process_single_document(project_name: str, document_name: Optional[str] = No
         logger.info(f"Tipo de documento determinado automáticamente: {document_type} para {document_name}")
     
     # Configurar cliente de Blob Storage
-    blob_client = BlobStorageClient()
+    blob_client = get_blob_storage_client()
     
     # Verificar que el documento existe en el blob storage
     if not blob_client.document_exists(project_name, document_name):
@@ -173,7 +177,7 @@ def process_complete_project(project_name: str, queue_type: str):
         logger.info(f"Starting complete project processing for: {project_name}")
         
         # Initialize blob storage client
-        blob_client = BlobStorageClient()
+        blob_client = get_blob_storage_client()
         
         # Step 1: Document Intelligence Processing
         logger.info("Step 1: Document Intelligence processing...")
@@ -206,7 +210,7 @@ def process_complete_project(project_name: str, queue_type: str):
         logger.info("Step 2: Checking if chunking is needed...")
         
         # Get concatenated content from all processed documents
-        blob_client = BlobStorageClient()
+        blob_client = get_blob_storage_client()
         concatenated_content = ""
         
         # Get list of successfully processed documents from the result
@@ -239,6 +243,8 @@ def process_complete_project(project_name: str, queue_type: str):
             max_tokens=100000,
             overlap_tokens=500
         )
+        # Un solo listado de processed/chunks en lugar de un HEAD por documento
+        chunking_processor.prefetch_chunked_documents(project_name)
         
         all_saved_files = []
         total_chunks_created = 0
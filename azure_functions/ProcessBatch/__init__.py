@@ -0,0 +1,113 @@
+import azure.functions as func
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, Any
+
+# Agregar el directorio padre al path para importar los módulos compartidos
+sys.path.append(str(Path(__file__).parent.parent))
+
+# Procesador de resultados compartido con PoolingProcess
+from shared_code.processors.batch_results_processor import BatchResultsProcessor
+from shared_code.utils.app_insights_logger import get_logger, generate_operation_id
+
+# Configurar logger
+logger = get_logger("ProcessBatch")
+
+def _load_message_batch_info(batch_processor: BatchResultsProcessor, message: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reconstruye el batch_info que PoolingProcess habría procesado en línea a partir del
+    mensaje (batch_id, project_name, blob_name, is_orphaned), descargando el archivo batch_info.
+
+    Args:
+        batch_processor: Procesador de resultados de la invocación
+        message: Mensaje deserializado de la cola
+
+    Returns:
+        batch_info con la misma forma que devuelve get_pending_batches
+    """
+    blob_name = message['blob_name']
+    batch_info = batch_processor._load_batch_info(blob_name)
+    if message.get('is_orphaned'):
+        return {
+            'batch_id': message['batch_id'],
+            'current_status': 'completed',
+            'project_name': message.get('project_name'),
+            'openai_log_path': blob_name,
+            'is_orphaned': True,
+            'batch_info': batch_info
+        }
+    batch_info['batch_id'] = message['batch_id']
+    batch_info['current_status'] = 'completed'
+    batch_info['blob_name'] = blob_name
+    batch_info['project_name'] = message.get('project_name') or batch_info.get('project_name')
+    return batch_info
+
+def main(msg: func.QueueMessage) -> None:
+    """
+    Azure Function con Queue Trigger que procesa un único batch completado.
+    PoolingProcess encola un mensaje por batch (POOLING_FANOUT_ENABLED=true) y el host
+    reparte los mensajes entre instancias según extensions.queues en host.json.
+
+    Args:
+        msg: Mensaje con batch_id, project_name, blob_name e is_orphaned; el batch_info se
+            descarga de nuevo desde blob_name
+    """
+    operation_id = generate_operation_id()
+
+    try:
+        message = msg.get_json()
+    except ValueError as e:
+        logger.log_error(
+            message=f"Mensaje de batch inválido: {str(e)}",
+            operation_id=operation_id,
+            error_code="INVALID_BATCH_MESSAGE"
+        )
+        return
+
+    batch_id = message.get('batch_id') if isinstance(message, dict) else None
+    if not batch_id or not message.get('blob_name'):
+        logger.warning(f"Mensaje sin batch_id o blob_name, se descarta. Operation ID: {operation_id}")
+        return
+
+    logger.log_operation_start(
+        operation_name="batch_results_processing",
+        operation_id=operation_id,
+        batch_id=batch_id,
+        dequeue_count=msg.dequeue_count
+    )
+
+    try:
+        batch_processor = BatchResultsProcessor(operation_id=operation_id)
+        batch_info = _load_message_batch_info(batch_processor, message)
+        results = batch_processor.process_completed_batch(
+            batch_id=batch_id,
+            batch_info=batch_info,
+            raise_on_error=True
+        )
+
+        if results:
+            logger.log_batch_operation(
+                batch_id=batch_id,
+                operation_id=operation_id,
+                status="completed_and_processed",
+                results_count=results.get('successful_responses', 0)
+            )
+
+        logger.log_operation_end(
+            operation_name="batch_results_processing",
+            operation_id=operation_id,
+            success=results is not None,
+            batch_id=batch_id
+        )
+
+    except Exception as e:
+        logger.log_error(
+            message=f"Error en ProcessBatch para batch {batch_id}: {str(e)}",
+            operation_id=operation_id,
+            error_code="PROCESS_BATCH_ERROR",
+            batch_id=batch_id
+        )
+        logging.error(f"Error en ProcessBatch: {str(e)}")
+        # Relanzar para que el host reintente el mensaje (y lo mueva a poison tras maxDequeueCount)
+        raise
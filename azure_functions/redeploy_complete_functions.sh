@@ -34,22 +34,34 @@ echo "ℹ️  No se activa entorno virtual automáticamente. Actívalo manualmen
 [ -f "requirements.txt" ] || { echo "❌ requirements.txt no encontrado"; exit 1; }
 [ -d "OpenAiProcess" ] || { echo "❌ Falta carpeta OpenAiProcess/"; exit 1; }
 [ -d "PoolingProcess" ] || { echo "❌ Falta carpeta PoolingProcess/"; exit 1; }
+[ -d "ProcessBatch" ] || { echo "❌ Falta carpeta ProcessBatch/"; exit 1; }
 [ -d "shared_code" ] || { echo "⚠️  shared_code/ no existe. Si tienes módulos locales, esto causará import errors."; }
 
 # 2) Limpiar ZIP previo
 rm -f "$DEPLOYMENT_ZIP"
 
+# 2.1) Precargar la caché BPE de tiktoken para empaquetarla (evita descargarla en cada arranque en frío)
+echo "🔤 Precargando caché de tiktoken..."
+if TIKTOKEN_CACHE_DIR="$SCRIPT_DIR/tiktoken_cache" python3 -c 'import tiktoken; tiktoken.encoding_for_model("gpt-4")'; then
+  echo "   • tiktoken_cache/ listo"
+else
+  echo "⚠️  No se pudo precargar tiktoken (¿no está instalado?); se descargará en el primer uso"
+fi
+
 # 3) Armar ZIP (sin venv local ni __pycache__)
 echo "📦 Empaquetando..."
 # Construir la lista de archivos a incluir de forma segura
 ZIP_FILES=()
 
 # Requeridos (ya validados arriba)
-ZIP_FILES+=(host.json requirements.txt OpenAiProcess/ PoolingProcess/)
+ZIP_FILES+=(host.json requirements.txt OpenAiProcess/ PoolingProcess/ ProcessBatch/)
 
 # Opcional: shared_code/
 if [[ -d shared_code ]]; then ZIP_FILES+=(shared_code/); fi
 
+# Opcional: caché de tiktoken precargada en el paso 2.1
+if [[ -d tiktoken_cache ]]; then ZIP_FILES+=(tiktoken_cache/); fi
+
 # Opcionales: prompts con espacios
 for f in "prompt Auditoria.txt" "prompt Desembolsos.txt" "prompt Productos.txt"; do
   [[ -f "$f" ]] && ZIP_FILES+=("$f")
@@ -69,7 +81,11 @@ echo "🔐 Verificando autenticación Azure..."
 az account show -o table >/dev/null
 
 # 6) Construir y aplicar App Settings en un solo llamado
-SETTINGS_TO_APPLY=()
+# BatchResultsQueueName es obligatorio: el queue trigger de ProcessBatch no se indexa sin él.
+# Va primero para que un valor de local.settings.json (SYNC_APP_SETTINGS=1) tenga precedencia
+SETTINGS_TO_APPLY=(
+  "BatchResultsQueueName=${BATCH_RESULTS_QUEUE_NAME:-batch-results-queue}"
+)
 
 # 6.1) Cargar settings desde local.settings.json si está habilitado
 if [[ "$SYNC_APP_SETTINGS" = "1" ]] && [ -f "local.settings.json" ]; then
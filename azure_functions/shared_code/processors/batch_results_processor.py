@@ -0,0 +1,2022 @@
+"""
+Procesamiento de resultados de batches de OpenAI: localiza los batches pendientes, descarga su
+salida y guarda los resultados por documento y por prompt en Blob Storage.
+
+Lo usan el timer PoolingProcess (sondeo y procesamiento en línea) y ProcessBatch (un batch por
+mensaje de cola en modo fan-out).
+"""
+
+import asyncio
+import codecs
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Set, Tuple, Union
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+from shared_code.utils.app_insights_logger import get_logger
+from shared_code.utils.blob_storage_client import BlobStorageClient, get_blob_storage_client
+from shared_code.utils.cosmo_db_client import CosmosDBClient
+from shared_code.utils.pooling_event_timer_processor import PoolingEventTimerProcessor
+
+try:
+    import orjson
+    # orjson.JSONDecodeError hereda de json.JSONDecodeError: los except existentes siguen valiendo
+    _json_loads = orjson.loads
+except ImportError:  # orjson es opcional: sin él se usa json estándar
+    _json_loads = json.loads
+
+# Archivos que debe contener una carpeta de resultados completa
+_REQUIRED_RESULT_FILES = frozenset({'auditoria.json', 'desembolsos.json', 'productos.json'})
+
+# Decodificador reutilizable para raw_decode (JSON válido más largo desde una posición)
+_JSON_DECODER = json.JSONDecoder()
+
+# Caracteres estructurales de JSON que importan al reparar contenido truncado
+_JSON_STRUCTURE_RE = re.compile(r'[\\"{}\[\]]')
+
+# Llaves y comillas (inicio de string) para delimitar objetos; un string JSON completo se
+# consume entero con _JSON_STRING_RE, sin visitar sus caracteres uno a uno
+_JSON_BRACE_OR_QUOTE_RE = re.compile(r'["{}]')
+_JSON_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+# Bloque de código ```json (o ``` sin lenguaje): 'body' hasta el último cierre del fence,
+# 'open' cuando no hay cierre (respuesta truncada)
+_FENCE_RE = re.compile(r'```(?:json)?[ \t]*\r?\n(?:(?P<body>.*)```|(?P<open>.*))', re.DOTALL)
+
+# Archivos batch_info de openai_logs; el grupo captura el proyecto
+_BATCH_INFO_RE = re.compile(r'basedocuments/([^/]+)/processed/openai_logs/batch_info_[^/]*\.json$')
+
+# Carpeta de results/ para cada tipo de prompt (también fija el orden de los {prompt}.json)
+_PROMPT_RESULT_FOLDERS = {
+    'auditoria': 'Auditoria',
+    'desembolsos': 'Desembolsos',
+    'productos': 'Productos'
+}
+
+# Tokens de prompt reconocidos en los custom_id. Se mapean a la constante canónica (interned),
+# así los dicts indexados por prompt comparan por identidad en vez de hash + comparación de texto
+_PROMPT_TYPES = {token: token for token in ('auditoria', 'desembolsos', 'productos')}
+_PROMPT_NUMBER_TYPES = {'prompt1': 'auditoria', 'prompt2': 'productos', 'prompt3': 'desembolsos'}
+
+# Tamaño de trozo para la descarga en streaming del archivo de salida de OpenAI
+_OUTPUT_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Segundos tras los cuales un claim de batch sin marcador se considera abandonado
+_BATCH_CLAIM_TTL_SECONDS = int(os.getenv("POOLING_BATCH_CLAIM_TTL_SECONDS", "3600"))
+
+@functools.lru_cache(maxsize=1)
+def _get_module_logger():
+    """Crea el logger del módulo en el primer uso (no en el import) para aligerar el cold start."""
+    return get_logger("batch_results_processor")
+
+@functools.lru_cache(maxsize=1)
+def _get_openai_client() -> AzureOpenAI:
+    """
+    Crea el cliente de Azure OpenAI usando el mismo patrón que OpenAiProcess.
+    Se crea una vez por proceso y se reutiliza entre ejecuciones del timer.
+    """
+    logger = _get_module_logger()
+    settings = _openai_connection_settings()
+    
+    logger.info(f"Configurando cliente OpenAI con endpoint: {settings['azure_endpoint']}")
+    logger.info(f"API Version: {settings['api_version']}")
+    
+    # Cliente HTTP/2 persistente: los batches.retrieve comparten una conexión TLS multiplexada
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        timeout=httpx.Timeout(30.0)
+    )
+    
+    return AzureOpenAI(http_client=http_client, **settings)
+
+def _openai_connection_settings() -> Dict[str, str]:
+    """Credenciales y endpoint de Azure OpenAI comunes a los clientes síncrono y asíncrono."""
+    api_key = os.getenv('AZURE_OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError("AZURE_OPENAI_API_KEY no encontrada en variables de entorno")
+    return {
+        'api_key': api_key,
+        'api_version': os.getenv('AZURE_OPENAI_API_VERSION', '2025-04-01-preview'),
+        'azure_endpoint': os.getenv('AZURE_OPENAI_ENDPOINT', 'https://oai-poc-idatafactory-cr.openai.azure.com/'),
+    }
+
+async def _retrieve_batch_statuses(batch_ids: List[str], max_concurrency: int) -> Dict[str, str]:
+    """
+    Consulta el estado de varios batches en un único event loop, con a lo sumo
+    max_concurrency peticiones en vuelo.
+
+    Returns:
+        Dict batch_id -> estado; los batches cuya consulta falló se omiten
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    http_client = httpx.AsyncClient(http2=True, timeout=httpx.Timeout(30.0))
+    async with AsyncAzureOpenAI(http_client=http_client, **_openai_connection_settings()) as client:
+        async def retrieve(batch_id: str) -> Tuple[str, Optional[str]]:
+            async with semaphore:
+                try:
+                    batch = await client.batches.retrieve(batch_id)
+                    return batch_id, batch.status
+                except Exception:
+                    # check_batch_status reintenta y registra el error por batch
+                    return batch_id, None
+
+        results = await asyncio.gather(*(retrieve(batch_id) for batch_id in batch_ids))
+    return {batch_id: status for batch_id, status in results if status}
+
+def _get_blob_client() -> BlobStorageClient:
+    """Cliente de Blob Storage compartido por proceso (reutiliza su pool de conexiones)."""
+    return get_blob_storage_client()
+
+@functools.lru_cache(maxsize=1)
+def _get_cosmos_client() -> CosmosDBClient:
+    """Cliente de Cosmos DB compartido por proceso."""
+    return CosmosDBClient()
+
+def _scan_json_structure(text: str) -> Tuple[List[str], Optional[str], Dict[str, int]]:
+    """
+    Recorre una sola vez los caracteres estructurales de un texto JSON (posiblemente truncado),
+    ignorando los que aparecen dentro de strings.
+
+    Args:
+        text: Texto JSON
+
+    Returns:
+        Tupla (cierres pendientes en orden de apertura, estado final de string: None, 'open' o
+        'escape' si termina en un escape colgante, conteo de '{', '}', '[' y ']' fuera de strings)
+    """
+    closers: List[str] = []
+    counts = {'{': 0, '}': 0, '[': 0, ']': 0}
+    in_string = False
+    skip_pos = -1
+    # Solo se visitan los caracteres estructurales; el resto del texto se salta en C
+    for match in _JSON_STRUCTURE_RE.finditer(text):
+        pos = match.start()
+        if pos == skip_pos:
+            # Carácter escapado dentro de un string
+            continue
+        ch = match.group()
+        if in_string:
+            if ch == '\\':
+                skip_pos = pos + 1
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+            continue
+        if ch == '\\':
+            # Barra invertida fuera de string (JSON inválido): no es estructural
+            continue
+        counts[ch] += 1
+        if ch == '{':
+            closers.append('}')
+        elif ch == '[':
+            closers.append(']')
+        elif closers:
+            closers.pop()
+
+    if not in_string:
+        string_state = None
+    elif skip_pos == len(text):
+        string_state = 'escape'
+    else:
+        string_state = 'open'
+    return closers, string_state, counts
+
+def _skip_json_object(text: str, start: int) -> int:
+    """
+    Devuelve la posición siguiente al '}' que cierra el objeto que empieza en start (llaves
+    fuera de strings), o len(text) si no llega a cerrarse.
+    """
+    depth = 0
+    pos = start
+    while True:
+        match = _JSON_BRACE_OR_QUOTE_RE.search(text, pos)
+        if match is None:
+            return len(text)
+        ch = match.group()
+        pos = match.end()
+        if ch == '"':
+            # Saltar el string completo; si no se cierra, el objeto tampoco
+            string_match = _JSON_STRING_RE.match(text, match.start())
+            if string_match is None:
+                return len(text)
+            pos = string_match.end()
+        elif ch == '{':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return pos
+
+def _parse_custom_id(custom_id: str) -> Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+    """
+    Descompone un custom_id en una sola pasada sobre sus tokens separados por '_'.
+    Patrones soportados:
+     - {project}_{document}_{prompt_type}[_chunk_{num}]
+     - {project}_{document}_prompt{n}  (n ∈ {1,2,3}; los chunks llegan como {document} = X_chunk_{num})
+
+    Args:
+        custom_id: ID de la request del batch
+
+    Returns:
+        Tupla (project, document_name, prompt_type, chunk_info) o None si el formato es inválido.
+        document_name conserva el sufijo _chunk_ (se usa como nombre de archivo); chunk_info se
+        obtiene de él.
+    """
+    parts = custom_id.split('_')
+    if len(parts) < 2:
+        return None
+    project_name = parts[0]
+    doc_start = len(project_name) + 1
+
+    # Buscar el token de prompt desde el final (el nombre del documento puede contener '_').
+    # token_end sigue la posición del token en custom_id para obtener el documento con un
+    # slice, sin volver a unir tokens
+    token_end = len(custom_id)
+    for idx in range(len(parts) - 1, 0, -1):
+        token = parts[idx]
+        token_start = token_end - len(token)
+        prompt_type = _PROMPT_TYPES.get(token)
+        if prompt_type is not None:
+            if idx > 1:
+                document_name = custom_id[doc_start:token_start - 1] + custom_id[token_end:]
+            else:
+                # Sin documento antes del prompt: se conserva el resto del custom_id
+                document_name = custom_id[doc_start:]
+            break
+        if token.startswith('prompt') and token[6:].isdigit():
+            prompt_type = _PROMPT_NUMBER_TYPES.get(token)
+            document_name = custom_id[doc_start:token_start - 1] if idx > 1 else project_name
+            break
+        token_end = token_start - 1
+    else:
+        return project_name, None, None, None
+
+    chunk_info = None
+    if '_chunk_' in document_name:
+        chunk_parts = document_name.split('_chunk_')
+        if len(chunk_parts) == 2:
+            chunk_info = f"chunk_{chunk_parts[1]}"
+    return project_name, document_name, prompt_type, chunk_info
+
+def _listing_max_workers() -> int:
+    """Hilos para listar proyectos y revisar archivos batch_info (POOLING_LISTING_MAX_WORKERS, por defecto 16)."""
+    try:
+        return max(1, int(os.getenv("POOLING_LISTING_MAX_WORKERS", "16")))
+    except ValueError:
+        return 16
+
+def _openai_max_concurrency() -> int:
+    """Llamadas simultáneas máximas a la API de batches de OpenAI (OPENAI_MAX_CONCURRENCY, por defecto 8)."""
+    try:
+        return max(1, int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")))
+    except ValueError:
+        return 8
+
+def _save_max_workers() -> int:
+    """Número máximo de subidas simultáneas a Blob Storage por batch (RESULTS_SAVE_MAX_WORKERS, por defecto 8)."""
+    try:
+        return max(1, int(os.getenv("RESULTS_SAVE_MAX_WORKERS", "8")))
+    except ValueError:
+        return 8
+
+def _etag_cache_max_entries() -> int:
+    """Archivos batch_info que se conservan con su ETag entre sondeos (POOLING_ETAG_CACHE_MAX_ENTRIES, por defecto 1024)."""
+    try:
+        return max(1, int(os.getenv("POOLING_ETAG_CACHE_MAX_ENTRIES", "1024")))
+    except ValueError:
+        return 1024
+
+def _cosmos_max_workers() -> int:
+    """Número máximo de upserts simultáneos a Cosmos al volcar las marcas (COSMOS_MAX_WORKERS, por defecto 16)."""
+    try:
+        return max(1, int(os.getenv("COSMOS_MAX_WORKERS", "16")))
+    except ValueError:
+        return 16
+
+class BatchResultsProcessor:
+    """
+    Procesador de resultados de batches de OpenAI basado en la lógica de results.py
+    """
+    
+    # batch_info parseados por ruta junto con su ETag. Persiste entre ejecuciones del timer en
+    # la misma instancia: mientras el archivo no cambie, la descarga es un 304 sin cuerpo.
+    # LRU acotada por _etag_cache_max_entries para que no crezca con cada batch_info visto
+    _etag_cache: "OrderedDict[str, Tuple[str, Dict[str, Any]]]" = OrderedDict()
+    _etag_cache_lock = threading.Lock()
+    
+    def __init__(self, operation_id: str):
+        self.operation_id = operation_id
+        self._logger = None
+        # Estado por hilo: main comparte una instancia entre varios batches en paralelo
+        self._thread_state = threading.local()
+        # Limita las consultas concurrentes a OpenAI para respetar el límite de peticiones por minuto
+        self._openai_semaphore = threading.Semaphore(_openai_max_concurrency())
+        # Listados y batch_info descargados durante un sondeo; get_pending_batches los reinicia
+        self._projects_cache: Optional[Set[str]] = None
+        self._listing_cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._batch_info_cache: Dict[str, Dict[str, Any]] = {}
+        # Estados de OpenAI y marcadores consultados en el sondeo (pendientes y huérfanos comparten batches)
+        self._status_cache: Dict[str, str] = {}
+        self._marker_cache: Dict[Tuple[str, str], bool] = {}
+        # Batches ya conciliados según Cosmos (lastProcessedBatchId) en el sondeo actual
+        self._reconciled_batch_ids: Set[str] = set()
+        # Con defer_cosmos_marks=True las marcas de carpeta procesada se acumulan y se escriben
+        # juntas en flush_cosmos_marks (una sola lectura para todos los batches del sondeo)
+        self.defer_cosmos_marks = False
+        # Instante (time.monotonic) a partir del cual no se inicia trabajo opcional; None sin límite
+        self.deadline: Optional[float] = None
+        self._cosmos_marks: Dict[str, Dict[str, Any]] = {}
+        self._cosmos_marks_lock = threading.Lock()
+        # Clientes compartidos a nivel de módulo: el worker de Functions se reutiliza entre
+        # invocaciones y así se conservan las conexiones (y sesiones TLS) abiertas
+        self.client = _get_openai_client()
+        self.blob_client = _get_blob_client()
+        
+    @property
+    def logger(self):
+        """Logger del procesador, creado en el primer uso y ligado al operation_id."""
+        if self._logger is None:
+            self._logger = get_logger("BatchResultsProcessor").bind(self.operation_id)
+        return self._logger
+
+    @property
+    def _current_prompt_type(self) -> Optional[str]:
+        """Prompt en curso al materializar archivos; aislado por hilo."""
+        return getattr(self._thread_state, 'prompt_type', 'auditoria')
+
+    @_current_prompt_type.setter
+    def _current_prompt_type(self, value: Optional[str]) -> None:
+        self._thread_state.prompt_type = value
+    
+    def get_pending_batches(self) -> List[Dict[str, Any]]:
+        """
+        Obtiene la lista de batches pendientes desde el blob storage
+        buscando archivos batch_info y verificando su estado en OpenAI
+        
+        Returns:
+            Lista de información de batches pendientes
+        """
+        try:
+            # Cada sondeo parte de un listado fresco; la búsqueda de huérfanos lo reutiliza
+            self._projects_cache = None
+            self._listing_cache.clear()
+            self._batch_info_cache.clear()
+            self._status_cache.clear()
+            self._marker_cache.clear()
+            self._reconciled_batch_ids = set()
+            
+            # Buscar archivos batch_info en las rutas específicas de cada proyecto
+            # Primero obtener lista de proyectos explorando basedocuments/
+            projects = self._list_projects()
+            
+            self.logger.info(f"Proyectos encontrados: {list(projects)}")
+            
+            # Si hay Cosmos configurado, filtrar proyectos a los que tengan isBatchPending=true
+            pending_set: Optional[Set[str]] = None
+            try:
+                container_folder = os.environ.get("COSMOS_CONTAINER_FOLDER")
+                if container_folder:
+                    cdb = _get_cosmos_client()
+                    timer_proc = PoolingEventTimerProcessor(cdb)
+                    pending_folders = timer_proc.get_pending_folders(container_folder)
+                    pending_set = set(pending_folders)
+                    # El último batch conciliado de cada carpeta ya tiene marcador: no consultar OpenAI
+                    self._reconciled_batch_ids = {
+                        folder['lastProcessedBatchId']
+                        for folder in pending_folders.values()
+                        if folder.get('lastProcessedBatchId')
+                    }
+                    if not pending_set:
+                        self.logger.info("No pending folders in Cosmos; skipping batch_info and orphan scan")
+                else:
+                    self.logger.info("COSMOS_CONTAINER_FOLDER not set; proceeding without Cosmos filtering")
+            except Exception as e:
+                self.logger.warning(f"Cosmos filtering not available: {str(e)}")
+                pending_set = None
+
+            # Buscar archivos batch_info en cada proyecto (aplicando filtro si existe)
+            # Saltar proyectos que no están marcados como pendientes
+            selected_projects = [
+                project for project in projects
+                if pending_set is None or project in pending_set
+            ]
+            batch_info_files = [
+                blob_info
+                for blob_info in self._list_openai_log_blobs(selected_projects)
+                if _BATCH_INFO_RE.match(blob_info['name'])
+            ]
+            
+            self.logger.info(f"Encontrados {len(batch_info_files)} archivos batch_info")
+            
+            # Estados de OpenAI de todos los batches en un solo event loop (también sirven a los huérfanos)
+            self._prefetch_batch_statuses(
+                self._parallel_map(self._peek_batch_id, batch_info_files)
+            )
+            
+            # Descarga + consulta de estado en paralelo; cada tarea devuelve el batch o None
+            pending_batches = [
+                entry for entry in self._parallel_map(self._inspect_batch_info_blob, batch_info_files)
+                if entry is not None
+            ]
+            
+            # Buscar batches completados en openai_logs que no tengan carpeta de resultados por batch_id (marcador).
+            # Sin carpetas pendientes en Cosmos no hay nada que buscar: evitar el recorrido completo
+            if pending_set is not None and not pending_set:
+                orphaned_batches = []
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self.logger.warning(
+                    "Deadline de polling alcanzado; se omite la búsqueda de batches huérfanos",
+                    event_type="polling_deadline_reached"
+                )
+                orphaned_batches = []
+            else:
+                # Mismos archivos batch_info que la pasada de pendientes (ya descargados y parseados)
+                orphaned_batches = self._find_orphaned_completed_batches(pending_set, batch_info_files)
+
+            # Desduplicar por batch_id, fusionando info de huérfanos
+            merged: Dict[str, Dict[str, Any]] = {}
+            for entry in pending_batches:
+                bid = entry.get('batch_id')
+                if not bid:
+                    continue
+                merged[bid] = dict(entry)
+            for orphan in orphaned_batches:
+                bid = orphan.get('batch_id')
+                if not bid:
+                    continue
+                if bid in merged:
+                    # Conservar current_status del entry original, marcar orphaned si aplica
+                    merged[bid]['is_orphaned'] = True
+                    # Preservar project_name y rutas si no estaban
+                    for k in ('project_name', 'openai_log_path', 'blob_name'):
+                        if k not in merged[bid] and k in orphan:
+                            merged[bid][k] = orphan[k]
+                else:
+                    merged[bid] = dict(orphan)
+
+            final_list = list(merged.values())
+            self.logger.info(f"Total de batches pendientes encontrados: {len(final_list)}")
+            return final_list
+            
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error obteniendo batches pendientes: {str(e)}",
+                error_code="GET_PENDING_BATCHES_ERROR"
+            )
+            return []
+    
+    def _inspect_batch_info_blob(self, blob_info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Descarga un archivo batch_info y consulta su estado en OpenAI
+        
+        Args:
+            blob_info: Blob batch_info listado en openai_logs
+            
+        Returns:
+            batch_info enriquecido si el batch sigue pendiente, None en otro caso
+        """
+        try:
+            batch_id = self._batch_id_for(blob_info)
+            
+            if not batch_id or batch_id in self._reconciled_batch_ids:
+                return None
+            
+            # Proyecto según la ruta basedocuments/{project}/... (OpenAiProcess escribe el mismo en el JSON)
+            path_project = blob_info['name'].split('/')[1]
+
+            # Verificar el estado actual del batch en OpenAI
+            current_status = self.check_batch_status(batch_id)
+            
+            # Solo incluir batches que están pendientes o completados sin marcador
+            if current_status not in ['validating', 'in_progress', 'finalizing', 'completed']:
+                return None
+            
+            # Si ya está 'completed' y existe marcador por batch, saltar para evitar reprocesos
+            if current_status == 'completed' and \
+               self._batch_results_marker_exists(path_project, batch_id):
+                self.logger.info(
+                    f"Marcador existente para batch {batch_id} en proyecto {path_project}; omitiendo de pendientes"
+                )
+                return None
+
+            # Solo los batches que se devuelven necesitan el contenido completo del batch_info
+            batch_info = self._load_batch_info(blob_info['name'])
+            batch_info['batch_id'] = batch_id
+            batch_info['current_status'] = current_status
+            batch_info['blob_name'] = blob_info['name']
+            # Inferir project_name desde la ruta si no viene en el JSON
+            batch_info['project_name'] = batch_info.get('project_name') or path_project
+            self.logger.info(f"Batch {batch_id} encontrado con estado: {current_status}")
+            return batch_info
+
+        except Exception as file_error:
+            self.logger.log_error(
+                message=f"Error procesando archivo batch_info {blob_info.get('name', 'unknown')}: {str(file_error)}",
+                error_code="BATCH_INFO_FILE_ERROR"
+            )
+            return None
+    
+    def _find_orphaned_completed_batches(self, pending_set: Optional[Set[str]] = None,
+                                         openai_log_files: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        Busca batches completados en openai_logs que no tengan carpeta de resultados
+        
+        Args:
+            pending_set: Proyectos pendientes según Cosmos; None para revisar todos
+            openai_log_files: Archivos batch_info ya listados en este sondeo; None para listarlos
+        
+        Returns:
+            Lista de batches huérfanos que necesitan procesamiento
+        """
+        try:
+            # Buscar archivos en openai_logs usando la estructura correcta
+            if openai_log_files is None:
+                projects = [
+                    project for project in self._list_projects()
+                    if pending_set is None or project in pending_set
+                ]
+                openai_log_files = self._list_openai_log_blobs(projects)
+            
+            self.logger.info(f"Encontrados {len(openai_log_files)} archivos en openai_logs")
+            
+            orphaned_batches = [
+                orphan for orphan in self._parallel_map(self._inspect_orphan_candidate, openai_log_files)
+                if orphan is not None
+            ]
+            
+            self.logger.info(f"Total de batches huérfanos encontrados: {len(orphaned_batches)}")
+            return orphaned_batches
+            
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error buscando batches huérfanos: {str(e)}",
+                error_code="FIND_ORPHANED_BATCHES_ERROR"
+            )
+            return []
+    
+    def _inspect_orphan_candidate(self, log_file: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Revisa un archivo de openai_logs y determina si corresponde a un batch huérfano
+        
+        Args:
+            log_file: Blob listado en openai_logs
+            
+        Returns:
+            Información del batch huérfano o None si no aplica
+        """
+        try:
+            # Extraer información del path del archivo
+            # Formato esperado: basedocuments/{project}/processed/openai_logs/batch_info_xxx.json
+            match = _BATCH_INFO_RE.match(log_file['name'])
+            if not match:
+                return None
+            
+            project_name = match.group(1)
+            batch_filename = log_file['name'].rsplit('/', 1)[-1]  # batch_info_xxx.json
+            
+            # batch_id desde los metadatos del listado (o del contenido si el blob no los tiene)
+            batch_id = self._batch_id_for(log_file)
+            
+            if not batch_id:
+                self.logger.warning(f"No se encontró batch_id en archivo {batch_filename}")
+                return None
+            if batch_id in self._reconciled_batch_ids:
+                return None
+            
+            # Nuevo criterio: verificar marcador por batch_id bajo results/batches/{batch_id}/processed.json
+            has_marker = self._batch_results_marker_exists(project_name, batch_id)
+
+            self.logger.info(
+                f"Verificando marcador para batch {batch_id}: project={project_name}, exists={has_marker}"
+            )
+
+            if not has_marker:
+                # Verificar estado del batch en OpenAI
+                current_status = self.check_batch_status(batch_id)
+
+                if current_status == 'completed':
+                    batch_info = self._load_batch_info(log_file['name'])
+                    orphaned_batch = {
+                        'batch_id': batch_id,
+                        'current_status': current_status,
+                        'project_name': project_name,
+                        'openai_log_path': log_file['name'],
+                        'is_orphaned': True,
+                        'batch_info': batch_info
+                    }
+
+                    self.logger.info(
+                        f"Batch huérfano encontrado (sin marcador): {batch_id} para proyecto {project_name}"
+                    )
+                    return orphaned_batch
+            return None
+
+        except Exception as file_error:
+            self.logger.log_error(
+                message=f"Error procesando archivo openai_logs {log_file.get('name', 'unknown')}: {str(file_error)}",
+                error_code="ORPHANED_BATCH_FILE_ERROR"
+            )
+            return None
+    
+    def _list_openai_log_blobs(self, projects: List[str]) -> List[Dict[str, Any]]:
+        """
+        Lista en paralelo los archivos batch_info de openai_logs de cada proyecto. El filtro
+        batch_info_ va en el prefijo, así el servicio no devuelve el resto de artefactos de la carpeta.
+        
+        Args:
+            projects: Nombres de proyecto bajo basedocuments/
+            
+        Returns:
+            Blobs de todos los proyectos, en el orden de la lista de proyectos
+        """
+        listings = self._parallel_map(
+            lambda project: self._list_blobs_cached(f"basedocuments/{project}/processed/openai_logs/batch_info_"),
+            projects
+        )
+        return [blob_info for listing in listings for blob_info in listing]
+    
+    def _list_projects(self) -> Set[str]:
+        """
+        Obtiene los nombres de proyecto únicos bajo basedocuments/
+        
+        Returns:
+            Conjunto de nombres de proyecto
+        """
+        if self._projects_cache is None:
+            # Listado jerárquico: basedocuments/{project}/ sin recorrer los blobs de cada proyecto
+            self._projects_cache = {
+                directory.rstrip('/').rsplit('/', 1)[-1]
+                for directory in self.blob_client.list_virtual_directories("basedocuments/")
+            }
+        return self._projects_cache
+    
+    def _list_blobs_cached(self, prefix: str) -> List[Dict[str, Any]]:
+        """
+        Lista blobs por prefijo (con metadatos) una sola vez por sondeo
+        
+        Args:
+            prefix: Prefijo a listar
+            
+        Returns:
+            Lista de blobs (compartida: no modificar)
+        """
+        listing = self._listing_cache.get(prefix)
+        if listing is None:
+            listing = self.blob_client.list_blobs_with_prefix(prefix=prefix, include_metadata=True)
+            self._listing_cache[prefix] = listing
+        return listing
+    
+    def _load_batch_info(self, blob_name: str) -> Dict[str, Any]:
+        """
+        Descarga (condicionada por ETag entre sondeos) y parsea un archivo batch_info una sola vez por sondeo
+        
+        Args:
+            blob_name: Ruta del archivo batch_info
+            
+        Returns:
+            Copia del batch_info (quien llama puede enriquecerla)
+        """
+        batch_info = self._batch_info_cache.get(blob_name)
+        if batch_info is None:
+            with self._etag_cache_lock:
+                cached = self._etag_cache.get(blob_name)
+                if cached is not None:
+                    self._etag_cache.move_to_end(blob_name)
+            batch_info_content, etag = self.blob_client.download_blob_if_modified(
+                blob_name, cached[0] if cached else None
+            )
+            if batch_info_content is None:
+                # 304: el archivo no cambió desde la última descarga
+                batch_info = cached[1]
+            else:
+                batch_info = _json_loads(batch_info_content)
+                if etag:
+                    with self._etag_cache_lock:
+                        self._etag_cache[blob_name] = (etag, batch_info)
+                        self._etag_cache.move_to_end(blob_name)
+                        while len(self._etag_cache) > _etag_cache_max_entries():
+                            self._etag_cache.popitem(last=False)
+            self._batch_info_cache[blob_name] = batch_info
+        return dict(batch_info)
+    
+    def _parallel_map(self, fn, items: List[Any]) -> List[Any]:
+        """
+        Aplica fn a cada elemento con un pool de hilos acotado (operaciones de red independientes)
+        
+        Args:
+            fn: Función a aplicar
+            items: Elementos de entrada
+            
+        Returns:
+            Resultados en el mismo orden que items
+        """
+        if not items:
+            return []
+        max_workers = min(_listing_max_workers(), len(items))
+        if max_workers == 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fn, items))
+    
+    def _check_results_folder_exists(self, results_path: str) -> bool:
+        """
+        Verifica si existe una carpeta de resultados con archivos JSON
+        
+        Args:
+            results_path: Path de la carpeta de resultados
+            
+        Returns:
+            True si existe la carpeta con archivos JSON, False en caso contrario
+        """
+        try:
+            # Nota: results_path ya incluye 'basedocuments/...'. No pasar container_name para evitar duplicar prefijo.
+            # Debe tener los 3 archivos principales: un HEAD por archivo, en paralelo, en lugar de listar la carpeta
+            base = results_path.rstrip('/')
+            return all(self._parallel_map(
+                self.blob_client.blob_exists,
+                [f"{base}/{file_name}" for file_name in sorted(_REQUIRED_RESULT_FILES)]
+            ))
+            
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error verificando carpeta de resultados {results_path}: {str(e)}",
+                error_code="CHECK_RESULTS_FOLDER_ERROR"
+            )
+            return False
+
+    def _batch_results_marker_exists(self, project_name: str, batch_id: str) -> bool:
+        """
+        Verifica si existe el marcador de resultados para un batch específico.
+        El marcador se guarda en: basedocuments/{project}/results/batches/{batch_id}/processed.json
+
+        Args:
+            project_name: Proyecto
+            batch_id: ID del batch
+
+        Returns:
+            True si existe el marcador, False en caso contrario
+        """
+        cache_key = (project_name, batch_id)
+        cached = self._marker_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            marker_path = f"basedocuments/{project_name}/results/batches/{batch_id}/processed.json"
+            exists = self.blob_client.blob_exists(marker_path)
+            self._marker_cache[cache_key] = exists
+            return exists
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error verificando marcador de batch {batch_id}: {str(e)}",
+                error_code="CHECK_BATCH_MARKER_ERROR",
+                batch_id=batch_id
+            )
+            return False
+    
+    def _batch_id_for(self, blob_info: Dict[str, Any]) -> Optional[str]:
+        """
+        Obtiene el batch_id de un archivo batch_info listado. Usa los metadatos del listado
+        (OpenAiProcess los escribe al subir el archivo) y solo descarga el contenido si faltan.
+        
+        Args:
+            blob_info: Blob batch_info listado con metadatos
+            
+        Returns:
+            batch_id o None si el archivo no lo contiene
+        """
+        batch_id = (blob_info.get('metadata') or {}).get('batch_id')
+        if batch_id:
+            return batch_id
+        return self._load_batch_info(blob_info['name']).get('batch_id')
+    
+    def _peek_batch_id(self, blob_info: Dict[str, Any]) -> Optional[str]:
+        """
+        Obtiene el batch_id de un archivo batch_info sin propagar errores
+        
+        Args:
+            blob_info: Blob batch_info listado
+            
+        Returns:
+            batch_id o None si no se pudo leer (el error se registra al inspeccionar el archivo)
+        """
+        try:
+            return self._batch_id_for(blob_info)
+        except Exception:
+            return None
+    
+    def _prefetch_batch_statuses(self, batch_ids: List[Optional[str]]) -> None:
+        """
+        Precarga en la caché del sondeo el estado de los batches con el cliente asíncrono.
+        Si falla, check_batch_status consulta cada batch por separado.
+        
+        Args:
+            batch_ids: IDs de batch (se ignoran vacíos, repetidos y ya cacheados)
+        """
+        missing = [
+            batch_id for batch_id in dict.fromkeys(batch_ids)
+            if batch_id and batch_id not in self._status_cache and batch_id not in self._reconciled_batch_ids
+        ]
+        if not missing:
+            return
+        try:
+            statuses = asyncio.run(_retrieve_batch_statuses(missing, _openai_max_concurrency()))
+        except Exception as e:
+            self.logger.warning(f"Consulta asíncrona de estados no disponible; se consultará por batch: {str(e)}")
+            return
+        self._status_cache.update(statuses)
+    
+    def check_batch_status(self, batch_id: str) -> str:
+        """
+        Verifica el estado de un batch específico
+        
+        Args:
+            batch_id: ID del batch a verificar
+            
+        Returns:
+            Estado del batch
+        """
+        cached = self._status_cache.get(batch_id)
+        if cached is not None:
+            return cached
+        try:
+            with self._openai_semaphore:
+                batch = self.client.batches.retrieve(batch_id)
+            # Los errores no se cachean: un fallo transitorio puede reintentarse en el mismo sondeo
+            self._status_cache[batch_id] = batch.status
+            return batch.status
+            
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error verificando estado del batch {batch_id}: {str(e)}",
+                error_code="CHECK_BATCH_STATUS_ERROR",
+                batch_id=batch_id
+            )
+            return 'error'
+    
+    def process_completed_batch(self, batch_id: str, batch_info: Dict[str, Any],
+                                raise_on_error: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Procesa un batch completado y descarga sus resultados
+        
+        Args:
+            batch_id: ID del batch completado
+            batch_info: Información adicional del batch
+            raise_on_error: Relanzar la excepción tras liberar el claim (ProcessBatch, para que
+                la cola reintente el mensaje) en lugar de devolver None
+            
+        Returns:
+            Resultados procesados del batch
+        """
+        claimed = False
+        try:
+            is_orphaned = batch_info.get('is_orphaned', False)
+
+            # Reclamar el batch antes de descargar nada de OpenAI: si otra invocación
+            # ya lo tiene, se evita la descarga duplicada de files.content
+            claimed = self._claim_batch(batch_id, batch_info)
+            if not claimed:
+                return None
+            
+            if is_orphaned:
+                self.logger.info(f"Procesando batch huérfano {batch_id}")
+                # Para batches huérfanos, descargar desde OpenAI ya que no tenemos los resultados guardados
+                batch = self.client.batches.retrieve(batch_id)
+                
+                if not batch.output_file_id:
+                    self.logger.warning(f"Batch huérfano {batch_id} completado pero sin archivo de salida")
+                    self._release_batch_claim(batch_id, batch_info)
+                    return None
+                
+                # Descargar y procesar el archivo de resultados desde OpenAI línea a línea
+                results = self._process_batch_results(
+                    self._iter_batch_output_lines(batch.output_file_id), batch_id
+                )
+                
+                # Guardar resultados procesados
+                self._save_processed_results(results, batch_id, batch_info, raise_on_error=raise_on_error)
+                # Guardar marcador por batch
+                self._save_batch_processed_marker(batch_id, batch_info, results)
+                
+                self.logger.info(f"Batch huérfano {batch_id} procesado exitosamente")
+                return results
+            else:
+                # Procesamiento normal para batches no huérfanos
+                batch = self.client.batches.retrieve(batch_id)
+                
+                if not batch.output_file_id:
+                    self.logger.warning(f"Batch {batch_id} completado pero sin archivo de salida")
+                    self._release_batch_claim(batch_id, batch_info)
+                    return None
+                
+                # Descargar y procesar el archivo de resultados línea a línea
+                results = self._process_batch_results(
+                    self._iter_batch_output_lines(batch.output_file_id), batch_id
+                )
+                
+                # Guardar resultados procesados
+                self._save_processed_results(results, batch_id, batch_info, raise_on_error=raise_on_error)
+                # Guardar marcador por batch
+                self._save_batch_processed_marker(batch_id, batch_info, results)
+                
+                return results
+            
+        except Exception as e:
+            error_type = "PROCESS_ORPHANED_BATCH_ERROR" if batch_info.get('is_orphaned', False) else "PROCESS_COMPLETED_BATCH_ERROR"
+            self.logger.log_error(
+                message=f"Error procesando batch {'huérfano' if batch_info.get('is_orphaned', False) else 'completado'} {batch_id}: {str(e)}",
+                error_code=error_type,
+                batch_id=batch_id
+            )
+            if claimed:
+                # Liberar el claim para que el siguiente tick pueda reintentar el batch
+                self._release_batch_claim(batch_id, batch_info)
+            if raise_on_error:
+                raise
+            return None
+
+    def _iter_batch_output_lines(self, output_file_id: str) -> Iterator[str]:
+        """
+        Descarga el archivo de salida de un batch en streaming y entrega sus líneas a medida
+        que llegan, sin materializar el JSONL completo (ni en bytes ni decodificado).
+
+        Args:
+            output_file_id: ID del archivo de salida en OpenAI
+
+        Yields:
+            Líneas del JSONL decodificadas en UTF-8, sin el salto de línea
+        """
+        # Decodificador incremental: un carácter multibyte puede quedar partido entre trozos
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        partial = ''
+        with self.client.files.with_streaming_response.content(output_file_id) as response:
+            for chunk in response.iter_bytes(chunk_size=_OUTPUT_DOWNLOAD_CHUNK_SIZE):
+                lines = (partial + decoder.decode(chunk)).split('\n')
+                partial = lines.pop()
+                yield from lines
+        partial += decoder.decode(b'', final=True)
+        if partial:
+            yield partial
+
+    def _resolve_project_name(self, batch_info: Dict[str, Any]) -> Optional[str]:
+        """
+        Determina el proyecto de un batch a partir de su batch_info.
+
+        Args:
+            batch_info: Información del batch
+
+        Returns:
+            Nombre del proyecto o None si no se puede deducir
+        """
+        project_name = batch_info.get('project_name') or batch_info.get('batch_info', {}).get('project_name')
+        if not project_name:
+            # Intentar deducir desde blob_name u openai_log_path si existe
+            blob_name = batch_info.get('blob_name') or batch_info.get('openai_log_path', '')
+            parts = blob_name.split('/')
+            if len(parts) >= 2:
+                project_name = parts[1]
+        return project_name or None
+
+    def _claim_batch(self, batch_id: str, batch_info: Dict[str, Any]) -> bool:
+        """
+        Reclama un batch creando results/batches/{batch_id}/claim.json con If-None-Match: *.
+        La creación condicional es atómica en el servicio, de modo que solo una invocación
+        concurrente (ticks solapados, fan-out, otra región) gana el batch.
+        Un claim más antiguo que POOLING_BATCH_CLAIM_TTL_SECONDS se considera abandonado y se reemplaza.
+
+        Args:
+            batch_id: ID del batch
+            batch_info: Información del batch
+
+        Returns:
+            True si esta invocación debe procesar el batch, False si otra ya lo tiene
+        """
+        project_name = self._resolve_project_name(batch_info)
+        if not project_name:
+            # Sin proyecto no hay dónde guardar el claim; mantener el comportamiento anterior
+            return True
+
+        result_name = f"batches/{batch_id}/claim.json"
+        claim_path = f"basedocuments/{project_name}/results/{result_name}"
+        claim_content = {
+            "batch_id": batch_id,
+            "operation_id": self.operation_id,
+            "claimed_at": datetime.now(timezone.utc).isoformat()
+        }
+
+        for _ in range(2):
+            try:
+                self.blob_client.save_result(
+                    project_name=project_name,
+                    result_name=result_name,
+                    content=claim_content,
+                    if_none_match="*"
+                )
+                return True
+            except ResourceExistsError:
+                properties = self.blob_client.get_blob_properties(claim_path)
+                if properties is None:
+                    # El claim desapareció entre medias; reintentar la creación
+                    continue
+                age = (datetime.now(timezone.utc) - properties.last_modified).total_seconds()
+                if age < _BATCH_CLAIM_TTL_SECONDS:
+                    self.logger.info(f"Batch {batch_id} ya reclamado por otra invocación, se omite")
+                    return False
+                try:
+                    # Quitar el claim abandonado solo si nadie lo renovó desde la lectura
+                    self.blob_client.delete_blob(claim_path, etag=properties.etag)
+                    self.logger.warning(f"Claim abandonado de batch {batch_id} ({int(age)}s), se reemplaza")
+                except ResourceModifiedError:
+                    self.logger.info(f"Batch {batch_id} reclamado por otra invocación, se omite")
+                    return False
+            except Exception as e:
+                # Un fallo del storage no debe bloquear el procesamiento
+                self.logger.warning(f"No se pudo reclamar batch {batch_id}: {str(e)}")
+                return True
+        return False
+
+    def _release_batch_claim(self, batch_id: str, batch_info: Dict[str, Any]) -> None:
+        """
+        Elimina el claim de un batch que no se pudo procesar para permitir reintentos.
+
+        Args:
+            batch_id: ID del batch
+            batch_info: Información del batch
+        """
+        project_name = self._resolve_project_name(batch_info)
+        if not project_name:
+            return
+        try:
+            self.blob_client.delete_blob(f"basedocuments/{project_name}/results/batches/{batch_id}/claim.json")
+        except Exception as e:
+            self.logger.warning(f"No se pudo liberar el claim del batch {batch_id}: {str(e)}")
+
+    def _save_batch_processed_marker(self, batch_id: str, batch_info: Dict[str, Any], results: Dict[str, Any]) -> None:
+        """
+        Guarda un marcador de procesamiento por batch bajo results/batches/{batch_id}/processed.json
+        con un resumen mínimo y referencias a archivos generados a nivel de proyecto.
+        """
+        try:
+            project_name = self._resolve_project_name(batch_info)
+            if not project_name:
+                self.logger.warning(f"No se pudo determinar project_name para guardar marcador de batch {batch_id}")
+                return
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            marker_content = {
+                "batch_id": batch_id,
+                "project_name": project_name,
+                "processed_at": timestamp,
+                "statistics": {
+                    "total_processed": results.get('total_processed', 0),
+                    "successful_responses": results.get('successful_responses', 0),
+                    "failed_responses": results.get('failed_responses', 0),
+                    "success_rate": results.get('success_rate', 0)
+                }
+            }
+
+            # Guardar bajo results/batches/{batch_id}/processed.json
+            result_name = f"batches/{batch_id}/processed.json"
+            try:
+                self.blob_client.save_result(
+                    project_name=project_name,
+                    result_name=result_name,
+                    content=marker_content,
+                    if_none_match="*"
+                )
+            except ResourceExistsError:
+                self.logger.info(f"Marcador de batch {batch_id} ya existe (otra invocación lo procesó), se omite")
+                return
+            self.logger.info(f"Marcador de batch guardado: basedocuments/{project_name}/results/{result_name}")
+
+            # Best-effort: actualizar Cosmos para apagar el pendiente
+            try:
+                sharepoint_folder = os.environ.get("SHAREPOINT_FOLDER")
+                container_folder = os.environ.get("COSMOS_CONTAINER_FOLDER")
+                if sharepoint_folder and container_folder:
+                    doc_id = f"{sharepoint_folder}|{project_name}"
+                    mark = {
+                        "isBatchPending": False,
+                        "lastProcessedBatchId": batch_id,
+                        "processedAt": timestamp,
+                        "lastStats": {
+                            "total_processed": results.get('total_processed', 0),
+                            "successful_responses": results.get('successful_responses', 0),
+                            "failed_responses": results.get('failed_responses', 0),
+                            "success_rate": results.get('success_rate', 0),
+                        }
+                    }
+                    if self.defer_cosmos_marks:
+                        with self._cosmos_marks_lock:
+                            self._cosmos_marks[doc_id] = mark
+                    else:
+                        cdb = _get_cosmos_client()
+                        doc = cdb.read_item(doc_id, doc_id, container_folder)
+                        if doc is not None:
+                            doc.update(mark)
+                            cdb.upsert_item(doc, container_folder)
+                            self.logger.info(f"CosmosDB folder marked processed: {doc_id}")
+                else:
+                    self.logger.info("Cosmos env not set; skipping folder processed mark")
+            except Exception as e:
+                self.logger.warning(f"Could not update Cosmos folder processed mark: {str(e)}")
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error guardando marcador de batch {batch_id}: {str(e)}",
+                error_code="SAVE_BATCH_MARKER_ERROR",
+                batch_id=batch_id
+            )
+    
+    def flush_cosmos_marks(self) -> None:
+        """
+        Escribe en Cosmos las marcas de carpeta procesada acumuladas con defer_cosmos_marks:
+        una consulta para leer todos los documentos y las escrituras en paralelo. Best-effort,
+        igual que la marca inmediata: los errores solo se registran.
+        """
+        with self._cosmos_marks_lock:
+            marks, self._cosmos_marks = self._cosmos_marks, {}
+        container_folder = os.environ.get("COSMOS_CONTAINER_FOLDER")
+        if not marks or not container_folder:
+            return
+        try:
+            cdb = _get_cosmos_client()
+            docs = cdb.query_items(
+                "SELECT * FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+                container_folder,
+                parameters=[{"name": "@ids", "value": list(marks)}]
+            )
+            for doc in docs:
+                doc.update(marks[doc['id']])
+
+            failed = cdb.upsert_items(docs, container_folder, max_workers=_cosmos_max_workers())
+            failed_ids = {doc['id'] for doc, _ in failed}
+            for doc, e in failed:
+                self.logger.warning(f"Could not update Cosmos folder processed mark {doc['id']}: {str(e)}")
+            for doc in docs:
+                if doc['id'] not in failed_ids:
+                    self.logger.info(f"CosmosDB folder marked processed: {doc['id']}")
+        except Exception as e:
+            self.logger.warning(f"Could not update Cosmos folder processed marks: {str(e)}")
+    
+    def _process_batch_results(self, content: Union[str, Iterable[str]], batch_id: str) -> Dict[str, Any]:
+        """
+        Procesa el contenido JSONL de los resultados del batch y los organiza por prompt
+        
+        Args:
+            content: Contenido JSONL de los resultados, completo o como iterable de líneas
+            batch_id: ID del batch
+            
+        Returns:
+            Dict con resultados procesados organizados por prompt
+        """
+        # Un solo acceso por nivel al insertar: {documento: {prompt: [resultados]}}
+        results_by_document = defaultdict(lambda: defaultdict(list))
+        results_by_prompt = {"auditoria": [], "desembolsos": [], "productos": []}
+        total_processed = 0
+        successful_responses = 0
+        failed_responses = 0
+        errors = []
+        # Un único timestamp para todo el batch (evita formatear la fecha en cada línea)
+        processed_at = datetime.now().isoformat()
+        
+        # Procesar cada línea del JSONL (las líneas vacías se omiten, así que no hace falta
+        # un strip() previo que copie el archivo completo)
+        lines = content.split('\n') if isinstance(content, str) else content
+        for line in lines:
+            if not line.strip():
+                continue
+                
+            try:
+                result = _json_loads(line)
+                
+                custom_id = result.get('custom_id', '')
+                response = result.get('response', {})
+                
+                if response.get('status_code') == 200:
+                    # Procesar y contabilizar cada objeto individual extraído
+                    added = self._process_successful_response(result, results_by_document, results_by_prompt, processed_at)
+                    successful_responses += int(added)
+                    total_processed += int(added)
+                else:
+                    failed_responses += 1
+                    total_processed += 1
+                    error_info = {
+                        'custom_id': custom_id,
+                        'status_code': response.get('status_code'),
+                        'error': response.get('body', {}),
+                        'processed_at': processed_at
+                    }
+                    errors.append(error_info)
+                    if self.logger.isEnabledFor(logging.WARNING):
+                        self.logger.warning(f"Respuesta fallida para {custom_id}: {response.get('status_code')}")
+                        
+            except json.JSONDecodeError as e:
+                failed_responses += 1
+                total_processed += 1
+                error_info = {
+                    'error': f"Error parsing JSON: {str(e)}",
+                    'line': line,
+                    'processed_at': processed_at
+                }
+                errors.append(error_info)
+                self.logger.error(f"Error parseando línea de resultado: {str(e)}")
+        
+        return {
+            'batch_id': batch_id,
+            'results_by_document': {doc: dict(sections) for doc, sections in results_by_document.items()},
+            'results_by_prompt': results_by_prompt,
+            'errors': errors,
+            'total_processed': total_processed,
+            'successful_responses': successful_responses,
+            'failed_responses': failed_responses,
+            'success_rate': (successful_responses / total_processed * 100) if total_processed > 0 else 0,
+            'processed_at': processed_at
+        }
+    
+    def _process_successful_response(self, result: Dict[str, Any], results_by_document: Dict, results_by_prompt: Dict,
+                                     processed_at: Optional[str] = None) -> int:
+        """
+        Procesa una respuesta exitosa y la organiza en las estructuras de datos.
+        
+        Args:
+            result: Resultado individual del batch
+            results_by_document: Dict para organizar por documento
+            results_by_prompt: Dict para organizar por prompt
+            processed_at: Timestamp ISO compartido por el batch (si None se calcula aquí)
+        """
+        try:
+            if processed_at is None:
+                processed_at = datetime.now().isoformat()
+            custom_id = result.get('custom_id', '')
+            response = result.get('response', {})
+            body = response.get('body', {})
+            
+            # Extraer información del custom_id
+            parsed_id = _parse_custom_id(custom_id)
+            if parsed_id is None:
+                if self.logger.isEnabledFor(logging.WARNING):
+                    self.logger.warning(f"Formato de custom_id inválido: {custom_id}")
+                return 0
+            project_name, document_name, prompt_type, chunk_info = parsed_id
+            
+            # Extraer contenido de la respuesta: acceso directo en el caso habitual,
+            # sin construir dicts por defecto en cada resultado
+            try:
+                raw_content = body['choices'][0]['message']['content']
+            except (KeyError, IndexError, TypeError):
+                if not body.get('choices'):
+                    if self.logger.isEnabledFor(logging.WARNING):
+                        self.logger.warning(f"No hay choices en la respuesta para {custom_id}")
+                    return 0
+                # Choice sin message/content
+                raw_content = ''
+
+            # Parsear múltiples objetos del contenido y normalizar por tipo de prompt
+            parsed_list = self._parse_multiple_json_objects(raw_content)
+            normalized_list = self._normalize_by_prompt(prompt_type, parsed_list)
+
+            # Resolver una sola vez por respuesta los buckets de destino y el usage compartido
+            document_bucket = results_by_document[document_name][prompt_type]
+            prompt_bucket = results_by_prompt.get(prompt_type)
+            usage = body.get('usage', {})
+
+            added = 0
+            for idx, obj in enumerate(normalized_list or []):
+                # Construir estructura de resultado por objeto
+                this_custom_id = custom_id if len(normalized_list) == 1 else f"{custom_id}_part_{idx+1:03d}"
+                result_data = {
+                    "custom_id": this_custom_id,
+                    "document_name": document_name,
+                    "prompt_type": prompt_type,
+                    "chunk_info": chunk_info,
+                    "content": obj,  # Guardamos el objeto ya parseado
+                    "usage": usage,
+                    "processed_at": processed_at
+                }
+
+                # Organizar por documento
+                document_bucket.append(result_data)
+
+                # Organizar por prompt
+                if prompt_bucket is not None:
+                    prompt_bucket.append(result_data)
+
+                added += 1
+
+            # Si no se pudo parsear/normalizar nada, preservamos el texto crudo como un item
+            if added == 0:
+                fallback = {
+                    "_raw_text": raw_content,
+                    "_parse_error": None
+                }
+                result_data = {
+                    "custom_id": custom_id,
+                    "document_name": document_name,
+                    "prompt_type": prompt_type,
+                    "chunk_info": chunk_info,
+                    "content": fallback,
+                    "usage": usage,
+                    "processed_at": processed_at
+                }
+                document_bucket.append(result_data)
+                if prompt_bucket is not None:
+                    prompt_bucket.append(result_data)
+                added = 1
+
+            return added
+        
+        except Exception as e:
+            self.logger.error(f"Error procesando respuesta exitosa {result.get('custom_id', 'unknown')}: {str(e)}")
+            return 0
+
+    def _parse_multiple_json_objects(self, content: str) -> List[Dict[str, Any]]:
+        """
+        Extrae 0..N objetos JSON desde un string que puede venir con fences ```json, listas, o
+        múltiples objetos concatenados. Aplica reparaciones leves si es posible.
+        """
+        if not content or not isinstance(content, str):
+            return []
+
+        text = content.strip()
+        # Remover fences de código (mismo patrón que _extract_json_content)
+        fence = _FENCE_RE.match(text)
+        if fence:
+            text = fence.group('body') if fence.group('body') is not None else fence.group('open')
+
+        text = text.strip()
+
+        def try_json_loads(s: str) -> Optional[Any]:
+            try:
+                return _json_loads(s)
+            except Exception:
+                return None
+
+        # Caso común: el texto completo es un único objeto o lista JSON; no hace falta separar nada.
+        # Solo se intenta si los delimitadores encajan, para no pagar la excepción con texto libre
+        if text[:1] == '{' and text[-1:] == '}' or text[:1] == '[' and text[-1:] == ']':
+            data = try_json_loads(text)
+            if isinstance(data, dict):
+                return [data]
+            if isinstance(data, list):
+                return [x for x in data if isinstance(x, (dict, list))]
+
+        # Intentar separar múltiples objetos `{...}{...}`: raw_decode tokeniza en C desde cada '{';
+        # un objeto inválido se salta entero (hasta su llave de cierre) para no extraer sus anidados
+        objs: List[Dict[str, Any]] = []
+        pos = text.find('{')
+        while pos != -1:
+            try:
+                data, end = _JSON_DECODER.raw_decode(text, pos)
+            except ValueError:
+                end = _skip_json_object(text, pos)
+            else:
+                if isinstance(data, dict):
+                    objs.append(data)
+            pos = text.find('{', end)
+
+        # Si no se separó nada, intentar reparaciones leves sobre todo el texto
+        if not objs:
+            repaired = text.replace(',}', '}').replace(',]', ']')
+            # recortar hasta el último '}' si parece truncado
+            last = repaired.rfind('}')
+            if last > 0:
+                candidate = repaired[: last + 1]
+                data = try_json_loads(candidate)
+                if isinstance(data, dict):
+                    return [data]
+                if isinstance(data, list):
+                    return [x for x in data if isinstance(x, (dict, list))]
+        return objs
+
+    def _normalize_by_prompt(self, prompt_type: Optional[str], objs: List[Any]) -> List[Dict[str, Any]]:
+        """Normaliza listas de objetos según el tipo de prompt. Aplana estructuras conocidas.
+        - desembolsos: aplanar {desembolsos:{proyectados,realizados}, metadata}
+        - productos: pasar tal cual (cada dict es un producto)
+        - auditoria: pasar tal cual
+        """
+        norm: List[Dict[str, Any]] = []
+        if not objs:
+            return norm
+
+        if prompt_type == 'desembolsos':
+            for item in objs:
+                if isinstance(item, dict) and isinstance(item.get('desembolsos'), dict):
+                    meta = item.get('metadata') if isinstance(item.get('metadata'), dict) else {}
+                    for k in ('proyectados', 'realizados'):
+                        arr = item['desembolsos'].get(k)
+                        if isinstance(arr, list):
+                            for row in arr:
+                                if isinstance(row, dict):
+                                    rec = dict(row)
+                                    rec['tipo_registro_norm'] = 'realizado' if k == 'realizados' else 'proyectado'
+                                    # mezclar metadata útil
+                                    for mk, mv in meta.items():
+                                        rec.setdefault(mk, mv)
+                                    norm.append(rec)
+                elif isinstance(item, dict):
+                    norm.append(item)
+        else:
+            # productos / auditoria / otros: pasar dicts tal cual
+            for item in objs:
+                if isinstance(item, dict):
+                    norm.append(item)
+        return norm
+
+    def _materialize_content_for_file(self, prompt_type: Optional[str], content: Any) -> Any:
+        """
+        Garantiza que el contenido a guardar en cada archivo por documento sea JSON parseado:
+        - Si viene con wrapper {'_raw_text': '<json>'}, parsea ese JSON y devuelve el objeto/array.
+        - Si es string JSON, lo parsea.
+        - Si ya es dict/list, lo retorna tal cual.
+        - Si falla el parseo, devuelve un contenido sin los campos de wrapper cuando sea posible.
+        """
+        try:
+            # Caso wrapper con _raw_text
+            if isinstance(content, dict) and '_raw_text' in content:
+                raw = content.get('_raw_text')
+                # Intentar parsear si es string
+                if isinstance(raw, str) and raw.strip():
+                    # Primero: extraer JSON de posibles fences o texto
+                    extracted = self._extract_json_content(raw)
+                    if isinstance(extracted, (dict, list)):
+                        return extracted
+                    # Segundo: intentar múltiples objetos concatenados o lista
+                    many = self._parse_multiple_json_objects(raw)
+                    if many:
+                        # Si hay un único objeto, devolverlo; si varios, devolver lista
+                        return many if len(many) > 1 else many[0]
+                    # Tercero: si raw parece ser JSON directo, intentar parsearlo
+                    if raw.strip().startswith(('{', '[')):
+                        try:
+                            return _json_loads(raw)
+                        except json.JSONDecodeError:
+                            pass
+                # Si ya viene como dict/list en _raw_text
+                if isinstance(raw, (dict, list)):
+                    return raw
+                # Fallback: eliminar campos de wrapper y devolver el resto
+                cleaned = dict(content)
+                cleaned.pop('_raw_text', None)
+                cleaned.pop('_parse_error', None)
+                # Si cleaned tiene contenido útil, devolverlo; sino devolver raw
+                if cleaned and any(v is not None for v in cleaned.values()):
+                    return cleaned
+                return raw if raw is not None else None
+
+            # Caso string JSON directo
+            if isinstance(content, str) and content.strip():
+                extracted = self._extract_json_content(content)
+                if isinstance(extracted, (dict, list)):
+                    return extracted
+                # Intentar múltiples objetos
+                many = self._parse_multiple_json_objects(content)
+                if many:
+                    return many if len(many) > 1 else many[0]
+                # Intentar parseo directo si parece JSON
+                if content.strip().startswith(('{', '[')):
+                    try:
+                        return _json_loads(content)
+                    except json.JSONDecodeError:
+                        pass
+                # Si no se puede parsear como JSON, crear estructura esperada según prompt
+                self.logger.debug(f"Contenido string no parseable como JSON, creando estructura por defecto: {content[:100]}...")
+                # Intentar determinar el tipo de prompt desde el contexto
+                prompt_type = getattr(self, '_current_prompt_type', 'auditoria')
+                return self._create_default_structure_for_unparseable_content(content, prompt_type)
+
+            # dict/list ya parseado - verificar que no esté vacío
+            if isinstance(content, (dict, list)):
+                return content if content else None
+            
+            # Otros tipos - devolver si no es None
+            return content if content is not None else None
+            
+        except Exception as e:
+            # Si algo falla, devolver el contenido original para no perder datos
+            self.logger.warning(f"Error en _materialize_content_for_file: {str(e)}")
+            return content
+    
+    def _diagnose_json_content(self, content: str, error_msg: str) -> str:
+        """
+        Diagnostica problemas comunes en contenido JSON para mejorar debugging
+        """
+        diagnostics = []
+        
+        # Verificar longitud
+        if len(content) > 10000:
+            diagnostics.append(f"Contenido muy largo ({len(content)} chars)")
+        
+        # Verificar caracteres problemáticos
+        if '\\x' in content:
+            diagnostics.append("Contiene caracteres de escape")
+        # Un único recorrido para llaves y corchetes (fuera de strings)
+        _, _, counts = _scan_json_structure(content)
+        if counts['{'] != counts['}']:
+            diagnostics.append(f"Llaves desbalanceadas: {counts['{']} vs {counts['}']}")
+        if counts['['] != counts[']']:
+            diagnostics.append(f"Corchetes desbalanceados: {counts['[']} vs {counts[']']}")
+        
+        # Verificar si parece truncado
+        if content.endswith(',') or content.endswith('"'):
+            diagnostics.append("Posiblemente truncado")
+        
+        # Verificar patrones comunes de error
+        if 'null,' in content:
+            diagnostics.append("Contiene null seguido de coma")
+        if '""' in content:
+            diagnostics.append("Contiene strings vacíos")
+        
+        return f"Diagnóstico: {'; '.join(diagnostics) if diagnostics else 'Sin patrones obvios'}"
+    
+    def _repair_truncated_json(self, json_content: str) -> str:
+        """
+        Intenta reparar JSON truncado cerrando strings no terminados y estructuras abiertas.
+        Los cierres se añaden en el orden inverso a la apertura (ver _scan_json_structure) y las
+        llaves o corchetes dentro de strings no se cuentan.
+        """
+        content = json_content.rstrip()
+        closers, string_state, _ = _scan_json_structure(content)
+
+        # Cerrar strings no terminados (descartando un escape colgante)
+        if string_state == 'escape':
+            content = content[:-1]
+        if string_state is not None:
+            content += '"'
+
+        # Remover comas finales y completar una clave sin valor antes de cerrar
+        content = content.rstrip()
+        while content.endswith(','):
+            content = content[:-1].rstrip()
+        if content.endswith(':'):
+            content += ' null'
+
+        # Cerrar estructuras abiertas en orden inverso a su apertura
+        return content + ''.join(reversed(closers))
+    
+    def _create_default_structure_for_unparseable_content(self, content: str, prompt_type: str = 'auditoria') -> Dict[str, Any]:
+        """
+        Crea una estructura por defecto con todos los campos esperados cuando el contenido no se puede parsear.
+        Esto corrige errores de parseo de OpenAI manteniendo la estructura consistente.
+        """
+        # Estructura base común para auditoría
+        auditoria_structure = {
+            "codigo_CFA": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "codigo_CFX": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "estado_informe_SSC": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "estado_informe_SSC_norm": "null",
+            "informe_auditoria_externa_se_entrego_SSC": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "informe_auditoria_externa_se_entrego_SSC_norm": "null",
+            "concepto_control_interno": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "concepto_control_interno_norm": "no se menciona",
+            "concepto_licitacion": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "concepto_licitacion_norm": "no se menciona",
+            "concepto_uso_recursos": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "concepto_uso_recursos_norm": "no se menciona",
+            "concepto_unidad_ejecutora": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "concepto_unidad_ejecutora_norm": "no se menciona",
+            "fecha_vencimiento_SSC": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "fecha_cambio_estado_informe_SSC": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "fecha_extraccion": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "fecha_ultima_revision": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "status_auditoria_SSC": "Pendiente",
+            "nombre_archivo": "unknown",
+            "texto_justificacion": {"quote": None},
+            "_parse_error": "Contenido no parseable - estructura por defecto generada",
+            "_original_content_preview": content[:200] if len(content) > 200 else content
+        }
+        
+        # Estructura para productos
+        productos_structure = {
+            "codigo_CFA": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "codigo_CFX": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "descripcion_producto": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "meta_producto": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "meta_unidad": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "meta_num": None,
+            "meta_unidad_norm": None,
+            "fuente_indicador": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "fecha_cumplimiento_meta": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "tipo_dato": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "tipo_dato_norm": None,
+            "caracteristica": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "caracteristica_norm": None,
+            "check_producto": "No",
+            "fecha_extraccion": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "fecha_ultima_revision": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "nombre_archivo": "unknown",
+            "_parse_error": "Contenido no parseable - estructura por defecto generada",
+            "_original_content_preview": content[:200] if len(content) > 200 else content
+        }
+        
+        # Estructura para desembolsos
+        desembolsos_structure = {
+            "codigo_CFA": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "tipo_registro": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "tipo_registro_norm": None,
+            "fecha_desembolso": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "monto_original": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "moneda": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "monto_usd": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "fuente_etiqueta": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "fuente_norm": None,
+            "fecha_extraccion": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "fecha_ultima_revision": {"value": None, "confidence": "NO_EXTRAIDO", "evidence": None},
+            "nombre_archivo": "unknown",
+            "_parse_error": "Contenido no parseable - estructura por defecto generada",
+            "_original_content_preview": content[:200] if len(content) > 200 else content
+        }
+        
+        # Devolver la estructura correcta según el tipo de prompt
+        if prompt_type == 'productos':
+            return productos_structure
+        elif prompt_type == 'desembolsos':
+            return desembolsos_structure
+        else:  # auditoria por defecto
+            return auditoria_structure
+     
+    def _extract_json_content(self, content: str) -> Any:
+        """
+        Extrae y parsea contenido JSON de diferentes formatos:
+        1. Bloques de código ```json
+        2. JSON directo
+        3. JSON embebido en texto
+        4. Manejo de JSON truncado/incompleto
+        """
+        if not content or not isinstance(content, str):
+            return content
+            
+        content_stripped = content.strip()
+
+        # Caso 1: Contenido en bloque de código ```json; un solo match separa el cuerpo del fence
+        fence = _FENCE_RE.match(content_stripped)
+        if fence:
+            closed = fence.group('body') is not None
+            json_content = (fence.group('body') if closed else fence.group('open')).strip()
+            try:
+                return _json_loads(json_content)
+            except json.JSONDecodeError as e:
+                error = e
+
+            # Vía lenta: sin cierre del bloque el JSON está posiblemente truncado
+            if not closed and not json_content.endswith(('}', ']')):
+                json_content = self._repair_truncated_json(json_content)
+                try:
+                    return _json_loads(json_content)
+                except json.JSONDecodeError as e:
+                    error = e
+
+            # Logging mejorado para debugging
+            content_preview = json_content[:200] + "..." if len(json_content) > 200 else json_content
+            diagnosis = self._diagnose_json_content(json_content, str(error))
+            self.logger.warning(f"No se pudo parsear JSON del bloque de código - Error: {str(error)} - {diagnosis} - Contenido: {content_preview}")
+            return content
+        
+        # Caso 2: Contenido que empieza directamente con { o [
+        if content_stripped.startswith(('{', '[')):
+            try:
+                return _json_loads(content_stripped)
+            except json.JSONDecodeError as e:
+                # Intentar reparar JSON truncado
+                try:
+                    repaired_json = self._repair_truncated_json(content_stripped)
+                    return _json_loads(repaired_json)
+                except Exception:
+                    pass
+                
+                # Logging mejorado para debugging
+                content_preview = content_stripped[:200] + "..." if len(content_stripped) > 200 else content_stripped
+                diagnosis = self._diagnose_json_content(content_stripped, str(e))
+                self.logger.warning(f"No se pudo parsear JSON directo - Error: {str(e)} - {diagnosis} - Contenido: {content_preview}")
+                return content
+        
+        # Caso 3: Devolver contenido original si no es JSON
+        return content
+     
+    def _save_results_parallel(self, project_name: str, uploads: List[Tuple[str, Any]]) -> List[Tuple[str, Exception]]:
+        """
+        Sube varios resultados a results/ solapando las peticiones de red con un pool de hilos.
+        Con PARALLEL_SAVE=false se suben en serie, en el mismo orden.
+        Si varias entradas comparten nombre solo se sube la última, que es la que prevalecería en serie.
+
+        Args:
+            project_name: Proyecto
+            uploads: Lista de tuplas (result_name, content)
+
+        Returns:
+            Lista de tuplas (result_name, excepción) de las subidas que fallaron
+        """
+        def _upload(item: Tuple[str, Any]) -> Optional[Tuple[str, Exception]]:
+            result_name, content = item
+            try:
+                self.blob_client.save_result(
+                    project_name=project_name,
+                    result_name=result_name,
+                    content=content
+                )
+                return None
+            except Exception as e:
+                return result_name, e
+
+        uploads = list(dict(uploads).items())
+        parallel = str(os.getenv("PARALLEL_SAVE", "true")).lower() in ("1", "true", "yes", "on")
+        if not parallel or len(uploads) < 2:
+            outcomes = [_upload(item) for item in uploads]
+        else:
+            max_workers = min(_save_max_workers(), len(uploads))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                outcomes = list(executor.map(_upload, uploads))
+        return [outcome for outcome in outcomes if outcome is not None]
+
+    def _load_stored_result(self, blob_name: str, prompt_type: str) -> Optional[Any]:
+        """
+        Descarga y parsea un archivo por documento ya guardado en results/
+
+        Args:
+            blob_name: Nombre completo del blob
+            prompt_type: Tipo de prompt (solo para el log)
+
+        Returns:
+            Objeto parseado o None si no se pudo leer
+        """
+        try:
+            return _json_loads(self.blob_client.download_blob(None, blob_name))
+        except Exception as e:
+            self.logger.warning(f"No se pudo agregar {blob_name} a {prompt_type}.json: {str(e)}")
+            return None
+
+    def _prompt_items_from_content(self, prompt_type: str, content: Any, materialized: Any) -> List[Any]:
+        """
+        Convierte el contenido ya materializado de un item en objetos para {prompt}.json
+
+        Args:
+            prompt_type: Tipo de prompt (auditoria, desembolsos, productos)
+            content: Contenido original del item (para la estructura por defecto en errores)
+            materialized: Resultado de _materialize_content_for_file sobre content
+
+        Returns:
+            Lista de objetos (dict o list) ya parseados; vacía si no hay contenido válido
+        """
+        # Filtrar solo contenido None o string vacío - preservar dicts estructurados
+        if materialized is None or materialized == "":
+            return []
+        try:
+            # Si es un dict o list válido, agregarlo
+            if isinstance(materialized, (dict, list)):
+                return [materialized]
+            # Si es string, intentar parsearlo como JSON
+            if isinstance(materialized, str) and materialized.strip():
+                # Estrategia 1: JSON directo
+                try:
+                    return [_json_loads(materialized)]
+                except json.JSONDecodeError:
+                    pass
+
+                # Estrategia 2: Extraer JSON con _extract_json_content
+                try:
+                    extracted = self._extract_json_content(materialized)
+                    if isinstance(extracted, (dict, list)):
+                        return [extracted]
+                except Exception:
+                    pass
+
+                # Estrategia 3: Parsear múltiples objetos JSON
+                try:
+                    many_objs = self._parse_multiple_json_objects(materialized)
+                    if many_objs:
+                        return list(many_objs)
+                except Exception:
+                    pass
+
+                # Si todas las estrategias fallan, omitir este contenido
+                content_preview = materialized[:300] + "..." if len(str(materialized)) > 300 else str(materialized)
+                self.logger.warning(f"No se pudo parsear contenido como JSON para {prompt_type}, omitiendo - Contenido: {content_preview}")
+            return []
+        except Exception as e:
+            self.logger.warning(f"Error procesando contenido para {prompt_type}: {str(e)}")
+            # Usar la estructura por defecto para errores de procesamiento
+            try:
+                default_structure = self._create_default_structure_for_unparseable_content(
+                    str(content) if content is not None else "Error de procesamiento", 
+                    prompt_type
+                )
+                # Agregar información del error
+                default_structure["_processing_error"] = str(e)
+                return [default_structure]
+            except Exception:
+                # Si incluso esto falla, entonces sí omitir
+                return []
+
+    def _save_processed_results(self, results: Dict[str, Any], batch_id: str, batch_info: Dict[str, Any],
+                                raise_on_error: bool = False) -> None:
+        """
+        Guarda los resultados procesados en Azure Blob Storage organizados por prompt
+        
+        Args:
+            results: Resultados procesados organizados por prompt
+            batch_id: ID del batch
+            batch_info: Información del batch
+            raise_on_error: Relanzar el error de guardado para que no se escriba el marcador
+        """
+        try:
+            # Extraer información del proyecto desde la metadata del batch o directamente del batch_info
+            metadata = batch_info.get('metadata', {})
+            project_name = (
+                batch_info.get('project_name') or  # Para batches huérfanos
+                metadata.get('project') or 
+                metadata.get('project_name')
+            )
+            document_name = metadata.get('document') or metadata.get('document_name')
+            
+            if not project_name:
+                self.logger.warning(f"No se encontró project_name en metadata del batch {batch_id}. Metadata disponible: {metadata}")
+                raise ValueError(f"Información de proyecto faltante en metadata del batch {batch_id}")
+            
+            # Usar nombres deterministas por batch para evitar duplicados por timestamps
+            # Alinear con convención usada en LLM_output: results_by_document_batch_<batch_id>.json
+            results_by_document_filename = f"results_by_document_batch_{batch_id}.json"
+            
+            # Guardar resultados organizados por prompt
+            # Alinear nombre con convención por batch
+            results_by_prompt_filename = f"results_by_prompt_batch_{batch_id}.json"
+            # Los agregados y los {prompt}.json se suben juntos más abajo, en un solo lote paralelo
+            required_uploads: List[Tuple[str, Any]] = [
+                (results_by_document_filename, results.get('results_by_document', {})),
+                (results_by_prompt_filename, results.get('results_by_prompt', {}))
+            ]
+            
+            # Una sola pasada por results_by_document: cada item se materializa una vez y alimenta
+            # tanto su archivo por documento como el agregado {prompt}.json (indexado por blob, como
+            # quedará guardado: si dos items comparten archivo prevalece el último)
+            # Estructura esperada (LLM_output):
+            #  - results/Productos/<documento>_producto_XXX.json
+            #  - results/Desembolsos/<documento>_desembolso_XXX.json
+            #  - results/Auditoria/<documento>_chunk_XXX_auditoria.json
+            by_doc = results.get('results_by_document', {}) or {}
+            results_prefix = f"basedocuments/{project_name}/results"
+            prompt_items: Dict[str, Dict[str, List[Any]]] = {prompt_type: {} for prompt_type in _PROMPT_RESULT_FOLDERS}
+            document_uploads: List[Tuple[str, Any]] = []
+            for doc_name, sections in by_doc.items():
+                if not isinstance(sections, dict):
+                    continue
+                for prompt_type, items in sections.items():
+                    if not items:
+                        continue
+                    folder = _PROMPT_RESULT_FOLDERS.get(prompt_type, prompt_type.capitalize())
+                    aggregate = prompt_items.get(prompt_type)
+                    # Establecer el contexto del prompt actual para _materialize_content_for_file
+                    self._current_prompt_type = prompt_type
+                    for item in items:
+                        if not isinstance(item, dict):
+                            continue
+                        content = item.get('content')
+                        if content is None:
+                            continue
+                        # Materializar contenido: parsear _raw_text o strings JSON
+                        materialized = self._materialize_content_for_file(prompt_type, content)
+                        # Nombre exacto: usar document_name del item (sin alterar)
+                        filename = item.get('document_name') or doc_name
+                        # Asegurar extensión .json
+                        filename = filename if filename.lower().endswith('.json') else f"{filename}.json"
+
+                        result_path = f"{folder}/{filename}"
+                        document_uploads.append((result_path, materialized))
+                        if aggregate is not None:
+                            aggregate[f"{results_prefix}/{result_path}"] = \
+                                self._prompt_items_from_content(prompt_type, content, materialized)
+            # Limpiar contexto del prompt
+            self._current_prompt_type = None
+
+            # Crear archivos separados por tipo de prompt
+            prompt_files_saved = []
+            for prompt_type, folder in _PROMPT_RESULT_FOLDERS.items():
+                batch_items = prompt_items[prompt_type]
+
+                # {prompt}.json agrega todos los archivos por documento de la carpeta, también los de
+                # batches anteriores; solo se descargan los que este batch no sobrescribe
+                prefix = f"{results_prefix}/{folder}/"
+                try:
+                    entries = self.blob_client.list_blobs_with_prefix(prefix=prefix)
+                except Exception as e:
+                    self.logger.warning(f"No se pudo listar carpeta {folder}: {str(e)}")
+                    entries = []
+
+                names = [
+                    entry.get('name') for entry in entries
+                    if isinstance(entry, dict) and (entry.get('name') or '').endswith('.json')
+                    and entry.get('name') not in batch_items
+                ]
+                # Descargar en paralelo y parsear los bytes directamente (sin pasar por str)
+                stored_items = dict(zip(names, self._parallel_map(
+                    lambda name, prompt_type=prompt_type: self._load_stored_result(name, prompt_type), names)))
+
+                # Mismo orden que el listado de la carpeta una vez subidos los archivos de este batch
+                parsed_items: List[Any] = []
+                for name in sorted(stored_items.keys() | batch_items.keys()):
+                    if name in batch_items:
+                        parsed_items.extend(batch_items[name])
+                    elif stored_items[name] is not None:
+                        parsed_items.append(stored_items[name])
+
+                # Aplanar a un arreglo JSON válido de objetos
+                array_items: List[Dict[str, Any]] = []
+                for parsed in parsed_items:
+                    if isinstance(parsed, dict):
+                        array_items.append(parsed)
+                    elif isinstance(parsed, list):
+                        for it in parsed:
+                            if isinstance(it, dict):
+                                array_items.append(it)
+
+                # Solo guardar si hay contenido válido
+                if array_items:
+                    required_uploads.append((f"{prompt_type}.json", array_items))
+                    prompt_files_saved.append(f"{prompt_type}.json ({len(array_items)} elementos)")
+                else:
+                    self.logger.warning(f"No se generó contenido válido para {prompt_type}.json - archivo omitido")
+                    prompt_files_saved.append(f"{prompt_type}.json (omitido - sin contenido válido)")
+
+            # Subir agregados, {prompt}.json y archivos por documento en un único lote paralelo.
+            # Un fallo en un agregado o en un {prompt}.json aborta el guardado; los de documentos solo se registran
+            required_names = {name for name, _ in required_uploads}
+            failed_required = []
+            for result_path, e in self._save_results_parallel(project_name, required_uploads + document_uploads):
+                if result_path in required_names:
+                    failed_required.append(e)
+                else:
+                    self.logger.warning(f"No se pudo guardar archivo por documento {result_path}: {str(e)}")
+            if failed_required:
+                raise failed_required[0]
+            for name, content in required_uploads[2:]:
+                self.logger.info(f"Archivo {name} guardado: {len(content)} elementos")
+
+            # Guardar resumen del batch
+            results_by_prompt = results.get('results_by_prompt', {}) or {}
+            summary = {
+                "project_name": project_name,
+                "batch_id": batch_id,
+                "processed_at": results.get('processed_at'),
+                "statistics": {
+                    "total_processed": results.get('total_processed', 0),
+                    "successful_responses": results.get('successful_responses', 0),
+                    "failed_responses": results.get('failed_responses', 0),
+                    "success_rate": results.get('success_rate', 0)
+                },
+                "output_files": {
+                    "by_document": results_by_document_filename,
+                    "by_prompt": results_by_prompt_filename,
+                    "separated_prompts": prompt_files_saved
+                },
+                "documents_processed": len(results.get('results_by_document', {})),
+                "prompts_results": {prompt_type: len(prompt_results) for prompt_type, prompt_results in results_by_prompt.items()}
+            }
+            
+            summary_filename = f"batch_summary_{batch_id}.json"
+            self.blob_client.save_result(
+                project_name=project_name,
+                result_name=summary_filename,
+                content=summary
+            )
+            
+            self.logger.log_batch_operation(
+                batch_id=batch_id,
+                status="results_saved",
+                results_count=results.get('successful_responses', 0),
+                errors_count=results.get('failed_responses', 0)
+            )
+            
+            # Log resumen detallado en un único registro (un envío a Application Insights)
+            summary_lines = [
+                f"📊 Procesamiento completado para batch {batch_id}:",
+                f"   📄 Total procesadas: {results.get('total_processed', 0)}",
+                f"   ✅ Exitosas: {results.get('successful_responses', 0)}",
+                f"   ❌ Fallidas: {results.get('failed_responses', 0)}",
+                f"   📈 Tasa de éxito: {results.get('success_rate', 0):.1f}%",
+                f"   📁 Archivos generados:",
+                f"      📋 Por documento: {results_by_document_filename}",
+                f"      🎯 Por prompt: {results_by_prompt_filename}",
+                f"      📊 Resumen: {summary_filename}"
+            ]
+            if prompt_files_saved:
+                summary_lines.append(f"      🗂️ Archivos separados por prompt:")
+                summary_lines.extend(f"         {file_info}" for file_info in prompt_files_saved)
+            self.logger.info("\n".join(summary_lines))
+            
+        except Exception as e:
+            self.logger.log_error(
+                message=f"Error guardando resultados del batch {batch_id}: {str(e)}",
+                error_code="SAVE_RESULTS_ERROR",
+                batch_id=batch_id
+            )
+            if raise_on_error:
+                raise
@@ -2,17 +2,75 @@ import re
 import os
 import tiktoken
 import json
-from typing import List, Dict, Any, Tuple
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Set, Tuple
 from pathlib import Path
 from datetime import datetime
 from shared_code.utils.jsonl_handler import JSONLHandler
 from shared_code.schemas.validation_schemas import validate_corpus_chunk
 from shared_code.utils.app_insights_logger import get_logger
-from shared_code.utils.blob_storage_client import BlobStorageClient
+from shared_code.utils.blob_storage_client import BlobStorageClient, get_blob_storage_client, serialize_json
 
 # Configure logging with Azure Application Insights
 logger = get_logger('chunking_processor')
 
+# Caché de BPE de tiktoken empaquetada con la Function (la genera redeploy_complete_functions.sh).
+# tiktoken lee TIKTOKEN_CACHE_DIR al cargar el encoding, así que basta con fijarla antes del
+# primer uso para no descargar el vocabulario en cada arranque en frío
+_BUNDLED_TIKTOKEN_CACHE = Path(__file__).resolve().parents[2] / "tiktoken_cache"
+if "TIKTOKEN_CACHE_DIR" not in os.environ and _BUNDLED_TIKTOKEN_CACHE.is_dir():
+    os.environ["TIKTOKEN_CACHE_DIR"] = str(_BUNDLED_TIKTOKEN_CACHE)
+
+# Patrones para identificar secciones. Se combinan en una sola alternancia dentro de un
+# lookahead: cada posición donde empieza algún separador es un corte, aunque los separadores
+# de distintos patrones se solapen (igual que al aplicarlos uno tras otro)
+_SECTION_PATTERNS = [
+    r'\n={50,}\n',  # Separadores de igual
+    r'\n-{50,}\n',  # Separadores de guión
+    r'\n--- DOCUMENT:.*?---\n',  # Separadores de documento
+    r'\n\n#{1,3}\s+',  # Títulos markdown
+    r'\n\n[A-Z][A-Z\s]{10,}\n',  # Títulos en mayúsculas
+]
+_SECTION_RE = re.compile('(?=' + '|'.join(f'(?:{pattern})' for pattern in _SECTION_PATTERNS) + ')')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+# Patrón mejorado para español: maneja ¿...?, comillas, números y minúsculas tras punto.
+# Empieza por la puntuación (no por un lookbehind) para que el motor salte directamente a
+# los candidatos; el grupo 1 es el espacio por el que se corta
+_SENTENCE_RE = re.compile(r'[.\?\!…](\s+)(?=["\'""«»¿¡]*[A-ZÁÉÍÓÚÑ0-9])')
+
+# Caracteres por token con los que se dimensiona el sufijo a tokenizar para el solapamiento
+# (holgado: en español un token ronda los 4 caracteres)
+_TAIL_CHARS_PER_TOKEN = 16
+
+
+def _chunk_upload_max_workers() -> int:
+    """Número máximo de chunks subidos (o escritos en disco) a la vez (CHUNK_UPLOAD_MAX_WORKERS, por defecto 16)."""
+    try:
+        return max(1, int(os.getenv("CHUNK_UPLOAD_MAX_WORKERS", "16")))
+    except ValueError:
+        return 16
+
+
+def _tokenizer_threads() -> int:
+    """Hilos del tokenizer para la tokenización por lotes (CHUNK_TOKENIZER_THREADS, por defecto los núcleos disponibles, máx. 8)."""
+    default = min(8, os.cpu_count() or 1)
+    try:
+        return max(1, int(os.getenv("CHUNK_TOKENIZER_THREADS", str(default))))
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=None)
+def _get_tokenizer(model_name: str) -> "tiktoken.Encoding":
+    """Encoding de tiktoken compartido por proceso (el vocabulario se parsea una sola vez)."""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # Fallback para modelos no reconocidos
+        return tiktoken.get_encoding("cl100k_base")
+
 
 class ChunkingProcessor:
     """Procesador de chunking para dividir documentos grandes en fragmentos manejables."""
@@ -32,16 +90,35 @@ class ChunkingProcessor:
         self.model_name = model_name
         self.generate_jsonl = generate_jsonl
         self.jsonl_handler = JSONLHandler() if generate_jsonl else None
-        self.blob_client = BlobStorageClient()
+        self.blob_client = get_blob_storage_client()
         # Control de guardado de metadatos de chunking (desactivado por defecto)
         self.save_chunk_metadata = str(os.getenv("SAVE_CHUNKING_METADATA", "false")).lower() in ("1", "true", "yes", "on")
+        # Conteo de tokens por texto del documento en curso (secciones, párrafos, candidatos)
+        self._token_counts: Dict[str, int] = {}
+        # Nombres de archivos en processed/chunks por proyecto (ver prefetch_chunked_documents)
+        self._chunk_files: Dict[str, Set[str]] = {}
         
-        # Inicializar el tokenizer
+        # Inicializar el tokenizer (compartido entre instancias del mismo proceso)
+        self.tokenizer = _get_tokenizer(model_name)
+    
+    def prefetch_chunked_documents(self, project_name: str) -> None:
+        """
+        Lista una sola vez la carpeta processed/chunks del proyecto para que
+        is_document_already_chunked responda sin una petición HEAD por documento.
+        Si el listado falla se mantiene la verificación individual.
+        
+        Args:
+            project_name: Nombre del proyecto
+        """
+        prefix = f"basedocuments/{project_name}/processed/chunks/"
         try:
-            self.tokenizer = tiktoken.encoding_for_model(model_name)
-        except KeyError:
-            # Fallback para modelos no reconocidos
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
+            self._chunk_files[project_name] = {
+                name[len(prefix):] for name in self.blob_client.iter_blob_names(prefix)
+            }
+            logger.info(f"Chunk files listed for {project_name}: {len(self._chunk_files[project_name])}")
+        except Exception as e:
+            self._chunk_files.pop(project_name, None)
+            logger.warning(f"Could not list chunk files for {project_name}, checking per document: {str(e)}")
     
     def is_document_already_chunked(self, document_name: str, project_name: str) -> bool:
         """
@@ -62,7 +139,13 @@ class ChunkingProcessor:
             # Buscar el primer chunk del documento
             chunk_filename = f"{doc_stem}_chunk_000.json"
             
-            if self.blob_client.document_exists_in_processed(project_name, "chunks", chunk_filename):
+            chunk_files = self._chunk_files.get(project_name)
+            if chunk_files is not None:
+                already_chunked = chunk_filename in chunk_files
+            else:
+                already_chunked = self.blob_client.document_exists_in_processed(project_name, "chunks", chunk_filename)
+            
+            if already_chunked:
                 logger.info(f"Document already chunked: {document_name} (checked via {chunk_filename})")
                 return True
             
@@ -74,52 +157,72 @@ class ChunkingProcessor:
             return False  # Si no podemos verificar, asumimos que necesita procesamiento
     
     def count_tokens(self, text: str) -> int:
-        """Cuenta el número de tokens en un texto."""
-        return len(self.tokenizer.encode(text))
+        """Cuenta el número de tokens en un texto (memoizado mientras se procesa el documento)."""
+        count = self._token_counts.get(text)
+        if count is None:
+            count = len(self.tokenizer.encode_ordinary(text))
+            self._token_counts[text] = count
+        return count
+
+    def _prime_token_counts(self, texts: List[str]) -> None:
+        """Tokeniza en una sola llamada por lotes los textos que aún no tienen conteo."""
+        pending = [text for text in dict.fromkeys(texts) if text not in self._token_counts]
+        if len(pending) > 1:
+            # tiktoken reparte el lote entre hilos de Rust sin retener el GIL
+            num_threads = min(_tokenizer_threads(), len(pending))
+            for text, tokens in zip(pending, self.tokenizer.encode_ordinary_batch(pending, num_threads=num_threads)):
+                self._token_counts[text] = len(tokens)
+    
+    def _tail_tokens(self, text: str, count: int) -> List[int]:
+        """
+        Devuelve los últimos `count` tokens de text tokenizando solo un sufijo del texto.
+        
+        El corte se hace justo después de un salto de línea seguido de un carácter no blanco:
+        el pre-tokenizador de tiktoken nunca une un token a través de ese punto, así que los
+        tokens del sufijo coinciden con los del texto completo. Si no hay un corte así o el
+        sufijo no alcanza, se tokeniza el texto entero.
+        """
+        if count <= 0:
+            return []
+        window_start = len(text) - count * _TAIL_CHARS_PER_TOKEN
+        if window_start > 0:
+            cut = text.find('\n', window_start)
+            while cut != -1 and (cut + 1 == len(text) or text[cut + 1].isspace()):
+                cut = text.find('\n', cut + 1)
+            if cut != -1:
+                tokens = self.tokenizer.encode_ordinary(text[cut + 1:])
+                if len(tokens) >= count:
+                    return tokens[-count:]
+        return self.tokenizer.encode_ordinary(text)[-count:]
     
     def split_by_sections(self, content: str) -> List[str]:
         """Divide el contenido por secciones usando separadores comunes."""
-        # Patrones para identificar secciones
-        section_patterns = [
-            r'\n={50,}\n',  # Separadores de igual
-            r'\n-{50,}\n',  # Separadores de guión
-            r'\n--- DOCUMENT:.*?---\n',  # Separadores de documento
-            r'\n\n#{1,3}\s+',  # Títulos markdown
-            r'\n\n[A-Z][A-Z\s]{10,}\n',  # Títulos en mayúsculas
-        ]
-        
-        sections = [content]
-        
-        for pattern in section_patterns:
-            new_sections = []
-            for section in sections:
-                parts = re.split(pattern, section)
-                if len(parts) > 1:
-                    # Mantener el separador con la sección siguiente
-                    for i, part in enumerate(parts):
-                        if i > 0:
-                            # Buscar el separador original
-                            match = re.search(pattern, section)
-                            if match:
-                                part = match.group() + part
-                        new_sections.append(part)
-                else:
-                    new_sections.append(section)
-            sections = new_sections
+        # Una sola pasada con todos los separadores; cada separador se mantiene con la
+        # sección siguiente (el que aparece en el texto, no el primero encontrado)
+        sections = []
+        start = 0
+        for match in _SECTION_RE.finditer(content):
+            if match.start() > start:
+                sections.append(content[start:match.start()])
+                start = match.start()
+        sections.append(content[start:])
         
         # Filtrar secciones vacías
         return [s.strip() for s in sections if s.strip()]
     
     def split_by_paragraphs(self, content: str) -> List[str]:
         """Divide el contenido por párrafos."""
-        paragraphs = re.split(r'\n\s*\n', content)
+        paragraphs = _PARAGRAPH_RE.split(content)
         return [p.strip() for p in paragraphs if p.strip()]
     
     def split_by_sentences(self, content: str) -> List[str]:
         """Divide el contenido por oraciones."""
-        # Patrón mejorado para español: maneja ¿...?, comillas, números y minúsculas tras punto
-        sentence_pattern = r'(?<=[.\?\!…])\s+(?=["\'""«»¿¡]*[A-ZÁÉÍÓÚÑ0-9])'
-        sentences = re.split(sentence_pattern, content)
+        sentences = []
+        start = 0
+        for match in _SENTENCE_RE.finditer(content):
+            sentences.append(content[start:match.start(1)])
+            start = match.end(1)
+        sentences.append(content[start:])
         return [s.strip() for s in sentences if s.strip()]
 
     def create_chunks_with_overlap(self, sections: List[str]) -> List[Dict[str, Any]]:
@@ -128,6 +231,8 @@ class ChunkingProcessor:
         current_chunk = ""
         current_tokens = 0
         chunk_index = 0
+        # Contar todas las secciones de una vez en lugar de una llamada al tokenizer por sección
+        self._prime_token_counts(sections)
         
         for i, section in enumerate(sections):
             section_tokens = self.count_tokens(section)
@@ -165,14 +270,14 @@ class ChunkingProcessor:
                     })
                     chunk_index += 1
                 
-                # Crear solapamiento con el chunk anterior
-                overlap_content = self._create_overlap(current_chunk)
+                # Crear solapamiento con el chunk anterior (solo hace falta tokenizar su final)
+                prev_tokens = self._tail_tokens(current_chunk, self.overlap_tokens + 1)
+                overlap_content = self._create_overlap(current_chunk, prev_tokens)
                 
                 # Verificar si el overlap + sección excede el límite
                 allowed_overlap_tokens = max(0, self.max_tokens - section_tokens)
                 if allowed_overlap_tokens < self.overlap_tokens:
                     # Recortar el solapamiento para que quepa
-                    prev_tokens = self.tokenizer.encode(current_chunk)
                     overlap_slice = prev_tokens[-allowed_overlap_tokens:] if allowed_overlap_tokens > 0 else []
                     overlap_content = self.tokenizer.decode(overlap_slice) if overlap_slice else ""
                 
@@ -209,38 +314,79 @@ class ChunkingProcessor:
         return chunks
     
     def _split_large_section(self, section: str, start_index: int) -> List[Dict[str, Any]]:
-        """Divide una sección muy grande en chunks más pequeños."""
-        chunks = []
-        
-        # Intentar dividir por párrafos primero
-        paragraphs = self.split_by_paragraphs(section)
-        
-        if len(paragraphs) > 1:
-            return self.create_chunks_with_overlap(paragraphs)
-        
-        # Si no hay párrafos, dividir por oraciones
-        sentences = self.split_by_sentences(section)
+        """
+        Divide una sección que excede max_tokens con ventanas deslizantes sobre sus tokens.
         
-        if len(sentences) > 1:
-            return self.create_chunks_with_overlap(sentences)
+        La sección se tokeniza una sola vez. Cada ventana avanza max_tokens - overlap_tokens y su
+        final se ajusta al último salto de párrafo (o, si no hay, de oración) que quede dentro de
+        los últimos overlap_tokens de la ventana; si tampoco hay, se corta en el límite de tokens.
         
-        # Último recurso: dividir por caracteres
-        chunk_size = self.max_tokens * 3  # Aproximación: 1 token ≈ 3-4 caracteres
-        text_chunks = [section[i:i+chunk_size] for i in range(0, len(section), chunk_size)]
+        Args:
+            section: Texto de la sección
+            start_index: Índice del primer chunk generado
+            
+        Returns:
+            Chunks de como máximo max_tokens tokens cada uno
+        """
+        token_ids = self.tokenizer.encode_ordinary(section)
+        total = len(token_ids)
+        if total <= self.max_tokens:
+            return [{
+                'index': start_index,
+                'content': section,
+                'tokens': total,
+                'sections_range': "Fragmento 1 de sección grande"
+            }]
+        
+        # Posición en caracteres de cada token, para cortar el texto sin decodificar cada ventana
+        text, offsets = self.tokenizer.decode_with_offsets(token_ids)
+        paragraph_breaks = self._token_breaks(offsets, (m.end() for m in _PARAGRAPH_RE.finditer(text)))
+        sentence_breaks = self._token_breaks(offsets, (m.end(1) for m in _SENTENCE_RE.finditer(text)))
         
-        for i, chunk_text in enumerate(text_chunks):
+        chunks = []
+        start = 0
+        while True:
+            end = min(start + self.max_tokens, total)
+            if end < total:
+                # Solo se ajusta dentro de la zona de solapamiento y dejando avance respecto a start
+                low = max(start + self.overlap_tokens, end - self.overlap_tokens)
+                end = (self._last_break(paragraph_breaks, low, end)
+                       or self._last_break(sentence_breaks, low, end)
+                       or end)
+            
+            char_end = offsets[end] if end < total else len(text)
             chunks.append({
-                'index': start_index + i,
-                'content': chunk_text,
-                'tokens': self.count_tokens(chunk_text),
-                'sections_range': f"Fragmento {i+1} de sección grande"
+                'index': start_index + len(chunks),
+                'content': text[offsets[start]:char_end],
+                'tokens': end - start,
+                'sections_range': f"Fragmento {len(chunks) + 1} de sección grande"
             })
-        
-        return chunks
+            if end >= total:
+                return chunks
+            start = max(end - self.overlap_tokens, start + 1)
+    
+    @staticmethod
+    def _token_breaks(offsets: List[int], char_positions) -> List[int]:
+        """Convierte posiciones de corte en caracteres al índice del token que empieza en ellas (ordenados)."""
+        breaks = []
+        for position in char_positions:
+            token_index = bisect_left(offsets, position)
+            if token_index < len(offsets) and (not breaks or breaks[-1] != token_index):
+                breaks.append(token_index)
+        return breaks
+    
+    @staticmethod
+    def _last_break(breaks: List[int], low: int, high: int) -> Optional[int]:
+        """Último corte en (low, high], o None si no hay ninguno."""
+        position = bisect_right(breaks, high)
+        if position and breaks[position - 1] > low:
+            return breaks[position - 1]
+        return None
     
-    def _create_overlap(self, content: str) -> str:
+    def _create_overlap(self, content: str, tokens: Optional[List[int]] = None) -> str:
         """Crea contenido de solapamiento del final del chunk anterior."""
-        tokens = self.tokenizer.encode(content)
+        if tokens is None:
+            tokens = self.tokenizer.encode_ordinary(content)
         
         if len(tokens) <= self.overlap_tokens:
             return content
@@ -251,8 +397,9 @@ class ChunkingProcessor:
         
         return overlap_text
     
-    def _create_jsonl_record(self, chunk: Dict[str, Any], project_name: str, chunk_metadata: Dict[str, Any]) -> Dict[str, Any]:
-        """Crea un registro JSONL a partir de un chunk."""
+    def _create_jsonl_record(self, chunk: Dict[str, Any], project_name: str, chunk_metadata: Dict[str, Any],
+                             timestamp: Optional[str] = None) -> Dict[str, Any]:
+        """Crea un registro JSONL a partir de un chunk (timestamp: marca de procesamiento ya formateada)."""
         return {
             'id_chunk': f"{project_name}_chunk_{chunk['index']:03d}",
             'proyecto': project_name,
@@ -263,7 +410,7 @@ class ChunkingProcessor:
             'estrategia_chunking': chunk_metadata.get('chunking_strategy', 'sections_with_overlap'),
             'max_tokens_configurado': chunk_metadata.get('max_tokens_per_chunk', self.max_tokens),
             'overlap_tokens': chunk_metadata.get('overlap_tokens', self.overlap_tokens),
-            'timestamp_procesamiento': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'timestamp_procesamiento': timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'fuente': 'document_intelligence_chunking',
             'version_esquema': '1.0'
         }
@@ -271,6 +418,8 @@ class ChunkingProcessor:
     def process_document_content(self, content: str, project_name: str) -> Dict[str, Any]:
         """Procesa el contenido de un documento y lo divide en chunks."""
         logger.info(f"Starting chunking for project: {project_name}")
+        # Los conteos memoizados solo valen para el documento en curso
+        self._token_counts = {}
         
         # Contar tokens totales
         total_tokens = self.count_tokens(content)
@@ -316,7 +465,7 @@ class ChunkingProcessor:
         }
     
     def save_chunks(self, chunking_result: Dict[str, Any], output_dir: str = "output_docs") -> List[str]:
-        """Guarda los chunks en archivos separados y genera un archivo JSONL individual por cada chunk."""
+        """Guarda los chunks en archivos MD separados y genera un único corpus JSONL con un registro por chunk."""
         project_name = chunking_result['project_name']
         
         # Crear estructura de carpetas: output_docs/{project_name}/docs/ y agents_output/
@@ -328,6 +477,13 @@ class ChunkingProcessor:
         
         chunks = chunking_result['chunks']
         saved_files = []
+        jsonl_records = []
+        # Una sola marca de tiempo para todos los registros del guardado
+        processed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Contenido de los MD preparado primero y escrito en paralelo (en un recurso compartido
+        # montado cada escritura es casi una ida y vuelta de red)
+        md_files: List[Tuple[Path, str]] = []
         
         for chunk in chunks:
             # Guardar chunk como archivo MD
@@ -346,51 +502,29 @@ class ChunkingProcessor:
 {chunk['content']}
 """
             
-            with open(chunk_filepath, 'w', encoding='utf-8') as f:
-                f.write(chunk_content)
-            
-            saved_files.append(str(chunk_filepath))
+            md_files.append((chunk_filepath, chunk_content))
             
-            # Generar archivo JSONL individual para este chunk si está habilitado
             if self.generate_jsonl:
-                jsonl_record = self._create_jsonl_record(chunk, project_name, chunking_result)
-                
-                # Crear archivo JSONL individual para este chunk
-                chunk_jsonl_filename = f"corpus_chunk_{chunk['index']:03d}.jsonl"
-                chunk_jsonl_path = agents_output_path / chunk_jsonl_filename
-                
-                # Validar y escribir registro JSONL individual
-                success = self.jsonl_handler.write_jsonl(
-                    [jsonl_record],  # Solo un registro por archivo
-                    str(chunk_jsonl_path), 
-                    validate_func=validate_corpus_chunk
-                )
-                
-                if success:
-                    saved_files.append(str(chunk_jsonl_path))
-                    logger.info(f"Chunk JSONL generated: {chunk_jsonl_path}")
-                else:
-                    logger.error(f"Error generating chunk JSONL: {chunk_jsonl_path}")
+                jsonl_records.append(self._create_jsonl_record(chunk, project_name, chunking_result, processed_at))
         
-        # También generar corpus JSONL completo para compatibilidad con documentos sin chunking
-        if self.generate_jsonl and len(chunks) > 1:
-            logger.info(f"\nGenerating complete corpus JSONL for compatibility...")
-            all_jsonl_records = []
-            for chunk in chunks:
-                jsonl_record = self._create_jsonl_record(chunk, project_name, chunking_result)
-                all_jsonl_records.append(jsonl_record)
-            
-            corpus_jsonl_path = agents_output_path / f"corpus_document_intelligence.jsonl"
+        saved_files.extend(self._write_text_files_parallel(md_files))
+        
+        # Corpus JSONL con todos los chunks, escrito de una vez (cada registro lleva su
+        # indice_chunk, así que no hace falta un archivo JSONL por chunk)
+        if self.generate_jsonl:
+            corpus_jsonl_path = agents_output_path / "corpus_document_intelligence.jsonl"
             success = self.jsonl_handler.write_jsonl(
-                all_jsonl_records, 
+                jsonl_records, 
                 str(corpus_jsonl_path), 
                 validate_func=validate_corpus_chunk
             )
             
             if success:
                 saved_files.append(str(corpus_jsonl_path))
-                logger.info(f"Complete corpus JSONL generated: {corpus_jsonl_path}")
-            logger.info(f"Total JSONL records: {len(all_jsonl_records)}")
+                logger.info(f"Corpus JSONL generated: {corpus_jsonl_path}")
+            else:
+                logger.error(f"Error generating corpus JSONL: {corpus_jsonl_path}")
+            logger.info(f"Total JSONL records: {len(jsonl_records)}")
         
         # Guardar metadatos del chunking en la carpeta docs (opcional)
         if self.save_chunk_metadata:
@@ -405,12 +539,61 @@ class ChunkingProcessor:
         
         return saved_files
 
+    def _write_text_files_parallel(self, files: List[Tuple[Path, str]]) -> List[str]:
+        """
+        Escribe varios archivos de texto locales con un pool de hilos.
+        Si alguna escritura falla la excepción se propaga, igual que en la escritura en serie.
+        
+        Args:
+            files: Lista de tuplas (ruta del archivo, contenido)
+            
+        Returns:
+            Rutas escritas, en el mismo orden que files
+        """
+        def _write(item: Tuple[Path, str]) -> str:
+            file_path, content = item
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            return str(file_path)
+        
+        max_workers = min(_chunk_upload_max_workers(), len(files))
+        if max_workers <= 1:
+            return [_write(item) for item in files]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_write, files))
+
+    def _upload_blobs_parallel(self, blob_client: BlobStorageClient, uploads: List[Tuple[str, bytes]]) -> List[str]:
+        """
+        Sube varios blobs solapando las peticiones de red con un pool de hilos.
+        Si alguna subida falla la excepción se propaga, igual que en la subida en serie.
+        
+        Args:
+            blob_client: Cliente de Blob Storage
+            uploads: Lista de tuplas (ruta del blob, contenido ya serializado)
+            
+        Returns:
+            Rutas subidas, en el mismo orden que uploads
+        """
+        def _upload(item: Tuple[str, bytes]) -> str:
+            blob_path, content = item
+            blob_client.upload_blob(blob_path, content)
+            logger.info(f"Chunk JSON saved to blob: {blob_path}")
+            return blob_path
+        
+        max_workers = min(_chunk_upload_max_workers(), len(uploads))
+        if max_workers <= 1:
+            return [_upload(item) for item in uploads]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_upload, uploads))
+
     def save_chunks_to_blob(self, chunking_result: Dict[str, Any], project_name: str) -> List[str]:
         """Guarda los chunks en blob storage como archivos JSON individuales, similar a la implementación local."""
         try:
-            blob_client = BlobStorageClient()
             chunks = chunking_result['chunks']
-            saved_files = []
+            # Serializar todo primero y subir en paralelo (cada subida es una ida y vuelta HTTPS)
+            uploads: List[Tuple[str, bytes]] = []
+            # Misma marca de creación para todos los chunks del guardado
+            created_at = datetime.now().isoformat()
             
             for chunk in chunks:
                 # Crear datos del chunk en formato JSON (similar a la implementación local)
@@ -421,7 +604,7 @@ class ChunkingProcessor:
                     'tokens': chunk['tokens'],
                     'sections_range': chunk['sections_range'],
                     'metadata': {
-                        'created_at': datetime.now().isoformat(),
+                        'created_at': created_at,
                         'project_name': project_name,
                         'total_chunks': len(chunks),
                         'chunking_strategy': chunking_result.get('chunking_strategy', 'unknown')
@@ -432,18 +615,18 @@ class ChunkingProcessor:
                 chunk_filename = f"{project_name}_chunk_{chunk['index']:03d}.json"
                 chunk_blob_path = f"basedocuments/{project_name}/processed/chunks/{chunk_filename}"
                 
-                chunk_content = json.dumps(chunk_data, indent=2, ensure_ascii=False)
-                blob_client.upload_blob(chunk_blob_path, chunk_content)
-                saved_files.append(chunk_blob_path)
-                logger.info(f"Chunk JSON saved to blob: {chunk_blob_path}")
+                # JSON compacto en bytes: estos blobs solo los lee el pipeline
+                chunk_content = serialize_json(chunk_data, compact=True)
+                uploads.append((chunk_blob_path, chunk_content))
             
-            # Guardar metadatos del chunking (opcional)
+            # Guardar metadatos del chunking (opcional), en el mismo lote que los chunks
             if self.save_chunk_metadata:
                 metadata_filename = f"{project_name}_chunking_metadata.json"
                 metadata_path = f"basedocuments/{project_name}/processed/chunks/{metadata_filename}"
-                metadata_content = json.dumps(chunking_result, indent=2, ensure_ascii=False)
-                blob_client.upload_blob(metadata_path, metadata_content)
-                saved_files.append(metadata_path)
+                metadata_content = serialize_json(chunking_result, compact=True)
+                uploads.append((metadata_path, metadata_content))
+            
+            saved_files = self._upload_blobs_parallel(self.blob_client, uploads)
             
             logger.info(f"Chunks saved to blob storage:")
             for file in saved_files:
@@ -458,9 +641,11 @@ class ChunkingProcessor:
     def save_chunks_to_blob_with_doc_name(self, chunking_result: Dict[str, Any], project_name: str, document_name: str) -> List[str]:
         """Guarda los chunks en blob storage con el nombre del documento original incluido."""
         try:
-            blob_client = BlobStorageClient()
             chunks = chunking_result['chunks']
-            saved_files = []
+            # Serializar todo primero y subir en paralelo (cada subida es una ida y vuelta HTTPS)
+            uploads: List[Tuple[str, bytes]] = []
+            # Misma marca de creación para todos los chunks del guardado
+            created_at = datetime.now().isoformat()
             
             # Extraer el nombre base del documento (sin extensión)
             doc_stem = Path(document_name).stem
@@ -474,7 +659,7 @@ class ChunkingProcessor:
                     'tokens': chunk['tokens'],
                     'sections_range': chunk['sections_range'],
                     'metadata': {
-                        'created_at': datetime.now().isoformat(),
+                        'created_at': created_at,
                         'project_name': project_name,
                         'original_document': document_name,
                         'total_chunks': len(chunks),
@@ -486,25 +671,28 @@ class ChunkingProcessor:
                 chunk_filename = f"{doc_stem}_chunk_{chunk['index']:03d}.json"
                 chunk_blob_path = f"basedocuments/{project_name}/processed/chunks/{chunk_filename}"
                 
-                chunk_content = json.dumps(chunk_data, indent=2, ensure_ascii=False)
-                blob_client.upload_blob(chunk_blob_path, chunk_content)
-                saved_files.append(chunk_blob_path)
-                logger.info(f"Chunk JSON saved to blob: {chunk_blob_path}")
+                # JSON compacto en bytes: estos blobs solo los lee el pipeline
+                chunk_content = serialize_json(chunk_data, compact=True)
+                uploads.append((chunk_blob_path, chunk_content))
             
-            # Guardar metadatos del chunking específicos para este documento
-            metadata_filename = f"{document_name}_chunking_metadata.json"
-            metadata_path = f"basedocuments/{project_name}/processed/chunks/{metadata_filename}"
+            # Guardar metadatos del chunking específicos para este documento (opcional)
+            if self.save_chunk_metadata:
+                metadata_filename = f"{document_name}_chunking_metadata.json"
+                metadata_path = f"basedocuments/{project_name}/processed/chunks/{metadata_filename}"
+                
+                # Agregar información del documento original a los metadatos
+                enhanced_metadata = chunking_result.copy()
+                enhanced_metadata['original_document'] = document_name
+                enhanced_metadata['document_stem'] = doc_stem
+                
+                metadata_content = serialize_json(enhanced_metadata, compact=True)
+                uploads.append((metadata_path, metadata_content))
             
-            # Agregar información del documento original a los metadatos
-            enhanced_metadata = chunking_result.copy()
-            enhanced_metadata['original_document'] = document_name
-            enhanced_metadata['document_stem'] = doc_stem
+            saved_files = self._upload_blobs_parallel(self.blob_client, uploads)
             
-            metadata_content = json.dumps(enhanced_metadata, indent=2, ensure_ascii=False)
-            if self.save_chunk_metadata:
-                blob_client.upload_blob(metadata_path, metadata_content)
-            if self.save_chunk_metadata:
-                saved_files.append(metadata_path)
+            # Mantener al día el listado precargado del proyecto
+            if project_name in self._chunk_files:
+                self._chunk_files[project_name].update(path.rsplit('/', 1)[-1] for path in saved_files)
             
             logger.info(f"Document {document_name} chunks saved to blob storage:")
             for file in saved_files:
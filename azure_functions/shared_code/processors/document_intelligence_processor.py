@@ -9,7 +9,7 @@ from azure.ai.documentintelligence import DocumentIntelligenceClient
 from azure.core.credentials import AzureKeyCredential
 from azure.core.exceptions import HttpResponseError
 from shared_code.processors.chunking_processor import ChunkingProcessor
-from shared_code.utils.blob_storage_client import BlobStorageClient
+from shared_code.utils.blob_storage_client import get_blob_storage_client
 from shared_code.utils.app_insights_logger import get_logger
 
 # Configure logging with Azure Application Insights
@@ -31,7 +31,7 @@ class DocumentIntelligenceProcessor:
         )
         
         # Initialize blob storage client
-        self.blob_client = BlobStorageClient()
+        self.blob_client = get_blob_storage_client()
         
         # Initialize chunking processor if auto_chunk is enabled
         if self.auto_chunk:
@@ -216,16 +216,17 @@ class DocumentIntelligenceProcessor:
     
     def _convert_to_markdown(self, result) -> str:
         """Convert Document Intelligence result to markdown format."""
-        markdown_content = ""
+        # Collect pieces and join once at the end (repeated += on a growing str copies it each time)
+        markdown_parts: List[str] = []
         
         # Add main text content
         if result.content:
-            markdown_content += result.content + "\n\n"
+            markdown_parts.append(result.content + "\n\n")
         
         # Add tables in markdown format
         if result.tables:
             for i, table in enumerate(result.tables):
-                markdown_content += f"\n## Table {i+1}\n\n"
+                markdown_parts.append(f"\n## Table {i+1}\n\n")
                 
                 # Create markdown table
                 if table.cells:
@@ -246,23 +247,23 @@ class DocumentIntelligenceProcessor:
                         for col_idx in range(max_col + 1):
                             cell_content = rows[row_idx].get(col_idx, "")
                             row_cells.append(cell_content)
-                        markdown_content += "| " + " | ".join(row_cells) + " |\n"
+                        markdown_parts.append("| " + " | ".join(row_cells) + " |\n")
                         
                         # Add header separator for first row
                         if row_idx == 0:
-                            markdown_content += "| " + " | ".join(["---"] * (max_col + 1)) + " |\n"
+                            markdown_parts.append("| " + " | ".join(["---"] * (max_col + 1)) + " |\n")
                 
-                markdown_content += "\n"
+                markdown_parts.append("\n")
         
         # Add key-value pairs
         if result.key_value_pairs:
-            markdown_content += "\n## Key-Value Pairs\n\n"
+            markdown_parts.append("\n## Key-Value Pairs\n\n")
             for pair in result.key_value_pairs:
                 key = pair.key.content if pair.key else ""
                 value = pair.value.content if pair.value else ""
-                markdown_content += f"**{key}**: {value}\n\n"
+                markdown_parts.append(f"**{key}**: {value}\n\n")
         
-        return markdown_content
+        return "".join(markdown_parts)
     
     def _extract_structured_data(self, result) -> Dict[str, Any]:
         """Extract structured data similar to Docling's JSON format."""
@@ -551,18 +552,21 @@ class DocumentIntelligenceProcessor:
                 failed_count += 1
         
         # Concatenate content from successful documents (exclude skipped ones from content)
-        concatenated_content = "\n\n" + "="*80 + "\n\n"
-        concatenated_content += f"PROJECT: {project_name.upper()}\n"
-        concatenated_content += f"PROCESSED DOCUMENTS: {successful_count}/{len(document_files)}\n"
-        concatenated_content += f"SKIPPED DOCUMENTS: {skipped_count}\n"
-        concatenated_content += f"PROCESSOR: Azure Document Intelligence\n"
-        concatenated_content += "="*80 + "\n\n"
+        content_parts = [
+            "\n\n" + "="*80 + "\n\n",
+            f"PROJECT: {project_name.upper()}\n",
+            f"PROCESSED DOCUMENTS: {successful_count}/{len(document_files)}\n",
+            f"SKIPPED DOCUMENTS: {skipped_count}\n",
+            f"PROCESSOR: Azure Document Intelligence\n",
+            "="*80 + "\n\n"
+        ]
         
         for doc in processed_documents:
             if doc["metadata"]["processing_status"] == "success":
-                concatenated_content += f"\n\n--- DOCUMENT: {doc['filename']} ---\n\n"
-                concatenated_content += doc["content"]
-                concatenated_content += "\n\n" + "-"*50 + "\n\n"
+                content_parts.append(f"\n\n--- DOCUMENT: {doc['filename']} ---\n\n")
+                content_parts.append(doc["content"])
+                content_parts.append("\n\n" + "-"*50 + "\n\n")
+        concatenated_content = "".join(content_parts)
         
         # Create final result
         result = {
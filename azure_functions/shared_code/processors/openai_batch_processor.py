@@ -9,7 +9,7 @@ from datetime import datetime
 from pathlib import Path
 from openai import AzureOpenAI
 from shared_code.utils.app_insights_logger import get_logger
-from shared_code.utils.blob_storage_client import BlobStorageClient
+from shared_code.utils.blob_storage_client import BlobStorageClient, get_blob_storage_client
 from shared_code.utils.cosmo_db_client import CosmosDBClient
 
 # Prompts como constantes
@@ -615,7 +615,7 @@ class OpenAIBatchProcessor:
         requests_manifest: List[Dict[str, Any]] = []
         
         try:
-            blob_client = BlobStorageClient()
+            blob_client = get_blob_storage_client()
             
             # Procesar documentos DI desde blob storage
             di_documents = blob_client.list_processed_documents(project_name)
@@ -679,7 +679,8 @@ class OpenAIBatchProcessor:
             # Guardar información del batch en blob storage
             batch_info_content = json.dumps(batch_info, indent=2, ensure_ascii=False)
             batch_info_path = f"basedocuments/{project_name}/processed/openai_logs/batch_info_{project_name}_{batch.id}.json"
-            blob_client.upload_blob(batch_info_path, batch_info_content)
+            # batch_id en metadatos: PoolingProcess lo obtiene del listado sin descargar el archivo
+            blob_client.upload_blob(batch_info_path, batch_info_content, metadata={"batch_id": batch.id})
 
             # Guardar manifest con prompt + contexto por request (para auditoría)
             try:
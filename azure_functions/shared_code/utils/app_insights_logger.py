@@ -90,7 +90,7 @@ class AppInsightsLogger:
     def __init__(self, 
                  name: str,
                  log_dir: str = "logs",
-                 log_level: str = "INFO",
+                 log_level: Optional[str] = None,
                  max_bytes: int = 10 * 1024 * 1024,  # 10MB
                  backup_count: int = 5):
         """
@@ -99,7 +99,7 @@ class AppInsightsLogger:
         Args:
             name: Nombre del logger
             log_dir: Directorio donde guardar los logs
-            log_level: Nivel de logging (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+            log_level: Nivel de logging (DEBUG, INFO, WARNING, ERROR, CRITICAL); por defecto LOG_LEVEL o INFO
             max_bytes: Tamaño máximo del archivo de log antes de rotar
             backup_count: Número de archivos de backup a mantener
         """
@@ -118,6 +118,7 @@ class AppInsightsLogger:
         
         # Crear logger
         self.logger = logging.getLogger(name)
+        log_level = log_level or os.getenv('LOG_LEVEL', 'INFO')
         self.logger.setLevel(getattr(logging, log_level.upper()))
         
         # Evitar duplicar handlers si ya existen
@@ -313,6 +314,22 @@ class AppInsightsLogger:
         
         self.logger.info(f"📊 Métrica {metric_name}: {value}", extra=extra)
     
+    def bind(self, operation_id: str) -> "BoundAppInsightsLogger":
+        """
+        Devuelve una vista de este logger con el operation_id fijado para los métodos log_*.
+        
+        Args:
+            operation_id: ID de la operación a incluir en cada evento
+            
+        Returns:
+            BoundAppInsightsLogger: Logger con contexto de operación
+        """
+        return BoundAppInsightsLogger(self, operation_id)
+    
+    def isEnabledFor(self, level: int) -> bool:
+        """Indica si un mensaje del nivel dado se emitiría (permite evitar formatear mensajes descartados)."""
+        return self.logger.isEnabledFor(level)
+    
     def debug(self, message: str, **kwargs):
         """Log de debug con campos personalizados."""
         extra = {'custom_fields': kwargs} if kwargs else {}
@@ -339,6 +356,40 @@ class AppInsightsLogger:
         self.logger.critical(message, extra=extra)
 
 
+
+class BoundAppInsightsLogger:
+    """
+    Logger con operation_id fijo: los métodos log_* lo incluyen sin que cada llamada
+    tenga que pasarlo. El resto de métodos (info, warning, ...) se delegan sin cambios.
+    """
+    
+    def __init__(self, logger: AppInsightsLogger, operation_id: str):
+        self._logger = logger
+        self.operation_id = operation_id
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._logger, name)
+    
+    def log_operation_start(self, operation_name: str, **kwargs) -> None:
+        self._logger.log_operation_start(operation_name, self.operation_id, **kwargs)
+    
+    def log_operation_end(self, operation_name: str, success: bool = True,
+                          duration_ms: Optional[float] = None, **kwargs) -> None:
+        self._logger.log_operation_end(operation_name, self.operation_id, success, duration_ms, **kwargs)
+    
+    def log_document_processing(self, document_name: str, stage: str, **kwargs) -> None:
+        self._logger.log_document_processing(document_name, self.operation_id, stage, **kwargs)
+    
+    def log_batch_operation(self, batch_id: str, status: str, **kwargs) -> None:
+        self._logger.log_batch_operation(batch_id, self.operation_id, status, **kwargs)
+    
+    def log_error(self, message: str, error_code: Optional[str] = None, **kwargs) -> None:
+        self._logger.log_error(message, self.operation_id, error_code, **kwargs)
+    
+    def log_metric(self, metric_name: str, value: float, **kwargs) -> None:
+        self._logger.log_metric(metric_name, value, operation_id=self.operation_id, **kwargs)
+
+
 def get_logger(name: str, **kwargs) -> AppInsightsLogger:
     """
     Factory function para crear loggers de Application Insights.
@@ -18,15 +18,59 @@ import os
 import json
 import tempfile
 import unicodedata
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional, BinaryIO, Callable
+from typing import List, Dict, Any, Optional, BinaryIO, Callable, Iterator, Tuple
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
-from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError
+from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, BlobPrefix
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import RequestsTransport
+import requests
+from azure.core.exceptions import ResourceNotFoundError, ResourceExistsError, HttpResponseError
 from shared_code.utils.app_insights_logger import get_logger
 
+try:
+    import orjson
+    # orjson.JSONDecodeError hereda de json.JSONDecodeError: los except existentes siguen valiendo
+    _json_loads = orjson.loads
+except ImportError:  # orjson es opcional: sin él se usa json estándar
+    orjson = None
+    _json_loads = json.loads
+
 logger = get_logger('blob_storage_client')
 
+# Descarga paralela de blobs grandes (resultados JSONL de varios MB)
+_DOWNLOAD_MAX_CONCURRENCY = int(os.getenv('BLOB_DOWNLOAD_MAX_CONCURRENCY', '8'))
+_DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Conexiones HTTP keep-alive por host; las subidas/descargas en paralelo (pools de hilos de
+# PoolingProcess) superan el valor por defecto de requests (10) y descartarían conexiones
+_HTTP_POOL_MAXSIZE = int(os.getenv('BLOB_HTTP_POOL_MAXSIZE', '64'))
+
+
+def serialize_json(content: Any, compact: bool = False) -> bytes:
+    """
+    Serializa contenido a JSON UTF-8 indentado directamente en bytes.
+    Usa orjson si está instalado (sin paso intermedio str -> bytes) y json estándar en caso contrario.
+
+    Args:
+        content: dict/list a serializar
+        compact: Si True, sin indentación ni espacios (para blobs que solo lee código)
+
+    Returns:
+        JSON codificado en UTF-8
+    """
+    if orjson is not None:
+        try:
+            option = orjson.OPT_NON_STR_KEYS if compact else orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+            return orjson.dumps(content, option=option)
+        except orjson.JSONEncodeError:
+            # Tipos no soportados por orjson (p.ej. enteros > 64 bits): usar json estándar
+            pass
+    if compact:
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json.dumps(content, ensure_ascii=False, indent=2).encode('utf-8')
+
 
 class BlobStorageClient:
     """
@@ -50,11 +94,29 @@ class BlobStorageClient:
         if not connection_string:
             raise ValueError("AZURE_STORAGE_CONNECTION_STRING no encontrada en variables de entorno")
         
-        self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        self.blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string,
+            transport=self._build_transport()
+        )
         self.container_client = self.blob_service_client.get_container_client(container_name)
         
         logger.info(f"Cliente Blob Storage inicializado: {storage_account_name}/{container_name}")
     
+    @staticmethod
+    def _build_transport() -> RequestsTransport:
+        """
+        Crea el transporte HTTP del cliente con un pool de conexiones dimensionado para
+        operaciones concurrentes desde varios hilos.
+        
+        Returns:
+            RequestsTransport con una sesión propia
+        """
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=_HTTP_POOL_MAXSIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return RequestsTransport(session=session, session_owner=True)
+    
     def _get_project_base_path(self, project_name: str) -> str:
         """
         Obtiene la ruta base del proyecto en el blob storage.
@@ -106,16 +168,11 @@ class BlobStorageClient:
             Lista de nombres de proyectos
         """
         try:
-            projects = set()
-            blobs = self.container_client.list_blobs(name_starts_with="basedocuments/")
-            
-            for blob in blobs:
-                # Extraer nombre del proyecto de la ruta: basedocuments/CAF123/...
-                path_parts = blob.name.split('/')
-                if len(path_parts) >= 2 and path_parts[0] == "basedocuments":
-                    projects.add(path_parts[1])
-            
-            project_list = list(projects)
+            # Listado jerárquico: una entrada por proyecto en lugar de una por blob
+            project_list = [
+                directory.rstrip('/').rsplit('/', 1)[-1]
+                for directory in self.list_virtual_directories("basedocuments/")
+            ]
             logger.info(f"Proyectos encontrados: {project_list}")
             return project_list
             
@@ -303,7 +360,7 @@ class BlobStorageClient:
             
             # Convertir contenido según el tipo
             if isinstance(content, (dict, list)):
-                data = json.dumps(content, ensure_ascii=False, indent=2).encode('utf-8')
+                data = serialize_json(content)
                 content_type = 'application/json'
             elif isinstance(content, str):
                 data = content.encode('utf-8')
@@ -343,7 +400,7 @@ class BlobStorageClient:
             
             # Intentar decodificar como JSON primero
             try:
-                return json.loads(data.decode('utf-8'))
+                return _json_loads(data)
             except json.JSONDecodeError:
                 # Si no es JSON, devolver como string
                 return data.decode('utf-8')
@@ -355,14 +412,19 @@ class BlobStorageClient:
             logger.error(f"Error cargando documento procesado {document_name}: {str(e)}")
             raise
     
-    def save_result(self, project_name: str, result_name: str, content: Any) -> str:
+    def save_result(self, project_name: str, result_name: str, content: Any,
+                    if_none_match: Optional[str] = None, content_type: Optional[str] = None) -> str:
         """
         Guarda un resultado final en la carpeta results/.
         
         Args:
             project_name: Nombre del proyecto
             result_name: Nombre del archivo de resultado
-            content: Contenido a guardar
+            content: Contenido a guardar (dict/list, str o bytes ya serializados)
+            if_none_match: Si es "*", solo crea el blob si no existe (If-None-Match: *).
+                           Si ya existe se lanza ResourceExistsError.
+            content_type: Content-Type a usar en lugar del deducido del tipo de contenido
+                          (p.ej. "application/json" para bytes de serialize_json)
             
         Returns:
             Ruta del blob guardado
@@ -373,21 +435,29 @@ class BlobStorageClient:
             
             # Convertir contenido según el tipo
             if isinstance(content, (dict, list)):
-                data = json.dumps(content, ensure_ascii=False, indent=2).encode('utf-8')
-                content_type = 'application/json'
+                data = serialize_json(content)
+                default_content_type = 'application/json'
             elif isinstance(content, str):
                 data = content.encode('utf-8')
-                content_type = 'text/plain'
+                default_content_type = 'text/plain'
             elif isinstance(content, (bytes, bytearray)):
                 data = bytes(content)
-                content_type = 'application/octet-stream'
+                default_content_type = 'application/octet-stream'
             else:
                 raise ValueError(f"Tipo de contenido no soportado: {type(content)}")
+            content_type = content_type or default_content_type
             
-            blob_client.upload_blob(data, overwrite=True, content_type=content_type)
+            if if_none_match == "*":
+                # Creación condicional atómica: el servicio responde 409/412 si el blob ya existe
+                blob_client.upload_blob(data, overwrite=False, content_type=content_type)
+            else:
+                blob_client.upload_blob(data, overwrite=True, content_type=content_type)
             logger.info(f"Resultado guardado: {blob_path}")
             return blob_path
             
+        except ResourceExistsError:
+            # Conflicto esperado en creaciones condicionales; lo decide el llamador
+            raise
         except Exception as e:
             logger.error(f"Error guardando resultado {result_name}: {str(e)}")
             raise
@@ -550,7 +620,8 @@ class BlobStorageClient:
             logger.error(f"Error creando archivo temporal para {document_name}: {str(e)}")
             raise
     
-    def upload_blob(self, blob_path: str, content: bytes, content_type: str = None) -> str:
+    def upload_blob(self, blob_path: str, content: bytes, content_type: str = None,
+                    metadata: Optional[Dict[str, str]] = None) -> str:
         """
         Sube contenido a un blob específico.
         
@@ -558,30 +629,68 @@ class BlobStorageClient:
             blob_path: Ruta completa del blob
             content: Contenido como bytes
             content_type: Tipo de contenido MIME
+            metadata: Metadatos del blob (valores ASCII); se devuelven al listar con include_metadata
             
         Returns:
             Ruta del blob creado
         """
         try:
             blob_client = self.container_client.get_blob_client(blob_path)
-            blob_client.upload_blob(content, overwrite=True, content_type=content_type)
+            blob_client.upload_blob(content, overwrite=True, content_type=content_type, metadata=metadata)
             logger.info(f"Blob subido: {blob_path}")
             return blob_path
         except Exception as e:
             logger.error(f"Error subiendo blob {blob_path}: {str(e)}")
             raise
 
-    def delete_blob(self, blob_path: str) -> None:
+    def get_blob_properties(self, blob_path: str) -> Optional[Any]:
+        """
+        Obtiene las propiedades de un blob con una sola petición HEAD.
+
+        Args:
+            blob_path: Ruta completa dentro del contenedor
+
+        Returns:
+            BlobProperties (etag, last_modified, size, metadata...) o None si el blob no existe
+        """
+        try:
+            blob_client = self.container_client.get_blob_client(blob_path)
+            return blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+
+    def blob_exists(self, blob_path: str) -> bool:
+        """
+        Verifica si existe un blob con una petición HEAD (sin listar el prefijo).
+
+        Args:
+            blob_path: Ruta completa dentro del contenedor
+
+        Returns:
+            True si el blob existe, False en caso contrario
+        """
+        return self.get_blob_properties(blob_path) is not None
+
+    def delete_blob(self, blob_path: str, etag: Optional[str] = None) -> None:
         """
         Elimina un blob del contenedor configurado.
 
         Args:
             blob_path: Ruta completa dentro del contenedor (por ejemplo,
                        "basedocuments/CAF123/processed/DI/doc.json")
+            etag: Si se indica, solo elimina el blob si no fue modificado desde ese ETag
+                  (lanza ResourceModifiedError en caso contrario)
         """
         try:
             blob_client = self.container_client.get_blob_client(blob_path)
-            if blob_client.exists():
+            if etag:
+                blob_client.delete_blob(
+                    delete_snapshots="include",
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified
+                )
+                logger.info(f"Blob eliminado: {blob_path}")
+            elif blob_client.exists():
                 blob_client.delete_blob(delete_snapshots="include")
                 logger.info(f"Blob eliminado: {blob_path}")
             else:
@@ -606,7 +715,8 @@ class BlobStorageClient:
         except Exception as e:
             logger.warning(f"Error eliminando archivo temporal {temp_path}: {str(e)}")
     
-    def list_blobs_with_prefix(self, prefix: str, container_name: Optional[str] = None, name_filter: Optional[Callable[[str], bool]] = None) -> List[Dict[str, str]]:
+    def list_blobs_with_prefix(self, prefix: str, container_name: Optional[str] = None, name_filter: Optional[Callable[[str], bool]] = None,
+                               include_metadata: bool = False) -> List[Dict[str, Any]]:
         """
         Lista blobs cuyo nombre empieza por el prefijo indicado. Compatible con PoolingProcess:
         - "container_name" se interpreta como carpeta raíz virtual (p.ej. "basedocuments/") dentro del contenedor por defecto
@@ -616,9 +726,11 @@ class BlobStorageClient:
             prefix: Prefijo del nombre del blob a buscar (e.g., "basedocuments/CAF123/processed/DI/") o relativo si se usa container_name
             container_name: Carpeta raíz virtual a anteponer al prefijo (NO cambia el contenedor real)
             name_filter: Función opcional (name -> bool) o cadena que debe estar contenida en el nombre
+            include_metadata: Si True, el listado trae los metadatos de cada blob en la misma respuesta
         
         Returns:
             Lista de dicts con la forma {"name": <nombre_completo_del_blob>}
+            (más "metadata": {...} si include_metadata)
         """
         try:
             # Trabajamos siempre en el contenedor configurado en el cliente
@@ -634,8 +746,11 @@ class BlobStorageClient:
                 else:
                     effective_prefix = f"{base}/{effective_prefix.lstrip('/')}"
 
-            blobs_iter = container_client.list_blobs(name_starts_with=effective_prefix)
-            results: List[Dict[str, str]] = []
+            if include_metadata:
+                blobs_iter = container_client.list_blobs(name_starts_with=effective_prefix, include=['metadata'])
+            else:
+                blobs_iter = container_client.list_blobs(name_starts_with=effective_prefix)
+            results: List[Dict[str, Any]] = []
 
             # Preparar filtro si viene como cadena
             filter_callable: Optional[Callable[[str], bool]] = None
@@ -650,12 +765,48 @@ class BlobStorageClient:
             for blob in blobs_iter:
                 name = blob.name
                 if filter_callable is None or filter_callable(name):
-                    results.append({"name": name})
+                    if include_metadata:
+                        results.append({"name": name, "metadata": blob.metadata or {}})
+                    else:
+                        results.append({"name": name})
             return results
         except Exception as e:
             logger.error(f"Error listando blobs con prefijo '{prefix}': {str(e)}")
             return []
     
+    def list_virtual_directories(self, prefix: str, delimiter: str = '/') -> List[str]:
+        """
+        Lista las carpetas virtuales inmediatamente bajo un prefijo (listado jerárquico).
+        El servicio devuelve una entrada por carpeta, sin enumerar los blobs que contienen.
+        
+        Args:
+            prefix: Prefijo padre terminado en el delimitador (e.g., "basedocuments/")
+            delimiter: Separador de carpetas virtuales
+            
+        Returns:
+            Prefijos completos de las carpetas, terminados en el delimitador (e.g., "basedocuments/CAF123/")
+        """
+        return [
+            item.name
+            for item in self.container_client.walk_blobs(name_starts_with=prefix, delimiter=delimiter)
+            if isinstance(item, BlobPrefix)
+        ]
+    
+    def iter_blob_names(self, prefix: str) -> Iterator[str]:
+        """
+        Itera perezosamente los nombres de blobs bajo un prefijo. Las páginas del listado se
+        solicitan a medida que se consumen, de modo que el llamador puede cortar antes de
+        recorrer todo el prefijo.
+        
+        Args:
+            prefix: Prefijo completo del blob dentro del contenedor (e.g., "basedocuments/CAF123/results/")
+            
+        Yields:
+            Nombre completo de cada blob
+        """
+        for blob in self.container_client.list_blobs(name_starts_with=prefix):
+            yield blob.name
+    
     def download_blob(self, container_name: Optional[str], blob_name: str) -> bytes:
         """
         Descarga un blob devolviendo su contenido como bytes. Compatible con el uso en PoolingProcess,
@@ -677,11 +828,48 @@ class BlobStorageClient:
                 path = blob_name
 
             blob_client = self.container_client.get_blob_client(path)
-            return blob_client.download_blob().readall()
+            # Los blobs pequeños se resuelven en la primera petición; los mayores que
+            # max_single_get_size se descargan en trozos paralelos de 4 MiB
+            return blob_client.download_blob(
+                max_concurrency=_DOWNLOAD_MAX_CONCURRENCY,
+                max_chunk_get_size=_DOWNLOAD_CHUNK_SIZE
+            ).readall()
         except Exception as e:
             logger.error(f"Error descargando blob '{blob_name}': {str(e)}")
             raise
     
+    def download_blob_if_modified(self, blob_path: str, etag: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Descarga un blob solo si cambió respecto al ETag indicado (If-None-Match). Si no cambió,
+        el servicio responde 304 sin cuerpo; el SDK lo relanza como ResourceModifiedError o
+        HttpResponseError según la versión, así que se reconoce por status_code.
+
+        Args:
+            blob_path: Ruta completa dentro del contenedor
+            etag: ETag de la copia que ya tiene el llamador; None para descargar siempre
+
+        Returns:
+            Tupla (contenido, etag). contenido es None si el blob no cambió desde etag
+        """
+        blob_client = self.container_client.get_blob_client(blob_path)
+        try:
+            if etag:
+                downloader = blob_client.download_blob(
+                    etag=etag,
+                    match_condition=MatchConditions.IfModified
+                )
+            else:
+                downloader = blob_client.download_blob()
+        except HttpResponseError as e:
+            if etag and e.status_code == 304:
+                return None, etag
+            logger.error(f"Error descargando blob '{blob_path}': {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Error descargando blob '{blob_path}': {str(e)}")
+            raise
+        return downloader.readall(), downloader.properties.etag
+    
     def list_blobs_with_prefix_names(self, prefix: str, container_name: Optional[str] = None, name_filter: Optional[Callable[[str], bool]] = None) -> List[str]:
         """
         Lista blobs cuyo nombre empieza por el prefijo indicado. Permite filtrar por nombre y cambiar el contenedor opcionalmente.
@@ -709,3 +897,15 @@ class BlobStorageClient:
         except Exception as e:
             logger.error(f"Error listando blobs con prefijo '{prefix}': {str(e)}")
             return []
+
+
+@lru_cache(maxsize=1)
+def get_blob_storage_client() -> BlobStorageClient:
+    """
+    Cliente de Blob Storage compartido por proceso: todas las operaciones reutilizan el mismo
+    BlobServiceClient y su pool de conexiones en lugar de abrir sesiones TLS nuevas.
+    
+    Returns:
+        BlobStorageClient con la configuración por defecto
+    """
+    return BlobStorageClient()
@@ -1,5 +1,6 @@
 import os
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 
 from azure.cosmos import CosmosClient, exceptions
 
@@ -26,6 +27,33 @@ class CosmosDBClient:
         container = self.database.get_container_client(container_name)
         return container.upsert_item(document)
 
+    def upsert_items(self, documents: List[Dict[str, Any]], container_name: str,
+                     max_workers: int = 16) -> List[Tuple[Dict[str, Any], Exception]]:
+        """
+        Upsert de varios documentos con escrituras concurrentes acotadas (cada documento puede
+        estar en su propia partición, así que no se usa TransactionalBatch). Los 429 los reintenta
+        el SDK respetando x-ms-retry-after-ms.
+        Devuelve (documento, excepción) de las escrituras que fallaron.
+        """
+        if not documents:
+            return []
+        container = self.database.get_container_client(container_name)
+
+        def _upsert(document: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], Exception]]:
+            try:
+                container.upsert_item(document)
+                return None
+            except Exception as e:
+                return document, e
+
+        workers = max(1, min(max_workers, len(documents)))
+        if workers == 1:
+            outcomes = [_upsert(document) for document in documents]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                outcomes = list(executor.map(_upsert, documents))
+        return [outcome for outcome in outcomes if outcome is not None]
+
     def read_item(self, item_id: str, partition_key: Any, container_name: str) -> Optional[Dict[str, Any]]:
         try:
             container = self.database.get_container_client(container_name)
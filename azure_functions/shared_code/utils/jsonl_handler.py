@@ -3,6 +3,20 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Any, Callable, Optional
 
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json estándar
+    orjson = None
+
+_WRITE_BUFFER_SIZE = 256 * 1024
+
+
+def _dump_line(record: Dict[str, Any]) -> bytes:
+    """Serializa un registro como una línea JSONL en UTF-8 (orjson si está disponible)."""
+    if orjson is not None:
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -29,7 +43,8 @@ class JSONLHandler:
             # Crear directorio padre si no existe
             Path(file_path).parent.mkdir(parents=True, exist_ok=True)
             
-            with open(file_path, 'w', encoding='utf-8') as f:
+            # Búfer amplio: un corpus de chunks son pocas líneas muy largas
+            with open(file_path, 'wb', buffering=_WRITE_BUFFER_SIZE) as f:
                 for record in records:
                     # Validar registro si se proporciona función de validación
                     if validate_func:
@@ -40,8 +55,7 @@ class JSONLHandler:
                             return False
                     
                     # Escribir registro como línea JSON
-                    json.dump(record, f, ensure_ascii=False)
-                    f.write('\n')
+                    f.write(_dump_line(record))
             
             return True
             
@@ -14,8 +14,15 @@ class PoolingEventTimerProcessor:
         self.cosmos_db_client = cosmos_db_client
 
     def process_batch(self, cosmos_container_folder: str) -> Set[str]:
+        return set(self.get_pending_folders(cosmos_container_folder))
+
+    def get_pending_folders(self, cosmos_container_folder: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Devuelve las carpetas con isBatchPending=true junto con su lastProcessedBatchId,
+        para que el polling pueda omitir batches ya conciliados sin consultar OpenAI.
+        """
         query = """
-            SELECT c.folderName
+            SELECT c.folderName, c.lastProcessedBatchId
             FROM c
             WHERE c.isBatchPending = true
         """
@@ -23,17 +30,16 @@ class PoolingEventTimerProcessor:
             rows: List[Dict[str, Any]] = self.cosmos_db_client.query_items(query, cosmos_container_folder)
         except Exception as e:
             logging.warning(f"Cosmos query failed for pending folders: {e}")
-            return set()
+            return {}
 
         if not rows:
             logging.info("No pending folders (isBatchPending=true) found in Cosmos")
-            return set()
+            return {}
 
-        folder_names: Set[str] = set()
+        folders: Dict[str, Dict[str, Any]] = {}
         for row in rows:
             name = row.get("folderName") if isinstance(row, dict) else None
             if isinstance(name, str) and name:
-                folder_names.add(name)
-        logging.info(f"Pending folders from Cosmos: {sorted(folder_names)}")
-        return folder_names
-
+                folders[name] = row
+        logging.info(f"Pending folders from Cosmos: {sorted(folders)}")
+        return folders
@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
 """
 Script para enviar un mensaje de prueba más simple al Service Bus.
+
+Usa el cliente asíncrono (azure.servicebus.aio); AMQP sobre WebSockets con ese
+cliente requiere aiohttp instalado en el entorno local (pip install aiohttp).
 """
 
 import os
 import json
-from azure.servicebus import ServiceBusClient, ServiceBusMessage, TransportType
+import asyncio
+from azure.servicebus import ServiceBusMessage, TransportType
+from azure.servicebus.aio import ServiceBusClient
 from dotenv import load_dotenv
 
-def send_simple_test_message():
+async def send_simple_test_message():
     """Enviar mensaje de prueba simple al Service Bus."""
     # Cargar variables de entorno desde local.settings.json
     import json
@@ -44,16 +49,15 @@ def send_simple_test_message():
             transport_type=TransportType.AmqpOverWebsocket
         )
         
-        with servicebus_client:
-            # Obtener sender para la cola
-            sender = servicebus_client.get_queue_sender(queue_name=queue_name)
-            
-            with sender:
-                # Crear mensaje
-                message = ServiceBusMessage(json.dumps(test_message))
+        async with servicebus_client:
+            # Obtener sender para la cola; se envía en un batch para poder reutilizar
+            # la misma conexión si se agregan más mensajes
+            async with servicebus_client.get_queue_sender(queue_name=queue_name) as sender:
+                batch = await sender.create_message_batch()
+                batch.add_message(ServiceBusMessage(json.dumps(test_message)))
                 
                 # Enviar mensaje
-                sender.send_messages(message)
+                await sender.send_messages(batch)
                 
                 print("✅ Mensaje de prueba enviado exitosamente")
                 print(f"📦 Cola: {queue_name}")
@@ -65,4 +69,4 @@ def send_simple_test_message():
         print(f"❌ Error enviando mensaje: {e}")
 
 if __name__ == "__main__":
-    send_simple_test_message()
+    asyncio.run(send_simple_test_message())
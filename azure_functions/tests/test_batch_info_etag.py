@@ -0,0 +1,86 @@
+"""
+Pruebas de la descarga condicionada por ETag de los archivos batch_info (respuesta 304).
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Agregar el directorio padre al path para importar los módulos compartidos
+sys.path.append(str(Path(__file__).parent.parent))
+
+from azure.core.exceptions import HttpResponseError, ResourceModifiedError
+from shared_code.utils.blob_storage_client import BlobStorageClient
+from shared_code.processors.batch_results_processor import BatchResultsProcessor
+
+
+def _http_error(error_cls, status_code):
+    """Error como lo relanza el SDK de Storage tras una respuesta sin cuerpo."""
+    error = error_cls(message=f"Operation returned an invalid status code ({status_code})")
+    error.status_code = status_code
+    return error
+
+
+def _blob_client_raising(error):
+    """BlobStorageClient sin conexión cuya descarga lanza el error indicado."""
+    client = BlobStorageClient.__new__(BlobStorageClient)
+    client.container_client = mock.Mock()
+    client.container_client.get_blob_client.return_value.download_blob.side_effect = error
+    return client
+
+
+class DownloadBlobIfModifiedTests(unittest.TestCase):
+
+    def test_304_as_http_response_error_returns_cached_etag(self):
+        client = _blob_client_raising(_http_error(HttpResponseError, 304))
+        self.assertEqual(client.download_blob_if_modified('a/batch_info_1.json', '"etag-1"'), (None, '"etag-1"'))
+
+    def test_304_as_resource_modified_error_returns_cached_etag(self):
+        client = _blob_client_raising(_http_error(ResourceModifiedError, 304))
+        self.assertEqual(client.download_blob_if_modified('a/batch_info_1.json', '"etag-1"'), (None, '"etag-1"'))
+
+    def test_other_status_is_raised(self):
+        client = _blob_client_raising(_http_error(HttpResponseError, 500))
+        with self.assertRaises(HttpResponseError):
+            client.download_blob_if_modified('a/batch_info_1.json', '"etag-1"')
+
+
+class LoadBatchInfoEtagTests(unittest.TestCase):
+
+    def setUp(self):
+        self._saved_cache = BatchResultsProcessor._etag_cache.copy()
+        BatchResultsProcessor._etag_cache.clear()
+
+    def tearDown(self):
+        BatchResultsProcessor._etag_cache.clear()
+        BatchResultsProcessor._etag_cache.update(self._saved_cache)
+
+    def _processor(self, blob_client):
+        processor = BatchResultsProcessor.__new__(BatchResultsProcessor)
+        processor._batch_info_cache = {}
+        processor.blob_client = blob_client
+        return processor
+
+    def test_second_poll_reuses_batch_info_on_304(self):
+        blob_client = mock.Mock()
+        blob_client.download_blob_if_modified.return_value = (b'{"batch_id": "b1"}', '"etag-1"')
+        self.assertEqual(self._processor(blob_client)._load_batch_info('a/batch_info_1.json'), {'batch_id': 'b1'})
+
+        # Siguiente sondeo (nueva instancia, misma clase): el servicio responde 304
+        blob_client.download_blob_if_modified.return_value = (None, '"etag-1"')
+        self.assertEqual(self._processor(blob_client)._load_batch_info('a/batch_info_1.json'), {'batch_id': 'b1'})
+        blob_client.download_blob_if_modified.assert_called_with('a/batch_info_1.json', '"etag-1"')
+
+    def test_etag_cache_is_bounded(self):
+        blob_client = mock.Mock()
+        blob_client.download_blob_if_modified.return_value = (b'{}', '"etag"')
+        with mock.patch.dict(os.environ, {'POOLING_ETAG_CACHE_MAX_ENTRIES': '2'}):
+            for index in range(3):
+                self._processor(blob_client)._load_batch_info(f'a/batch_info_{index}.json')
+        self.assertEqual(list(BatchResultsProcessor._etag_cache), ['a/batch_info_1.json', 'a/batch_info_2.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
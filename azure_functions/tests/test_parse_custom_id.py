@@ -0,0 +1,45 @@
+"""
+Pruebas del parseo de custom_id de los resultados de batch.
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+# Agregar el directorio padre al path para importar los módulos compartidos
+sys.path.append(str(Path(__file__).parent.parent))
+
+from shared_code.processors.batch_results_processor import _parse_custom_id
+
+
+class ParseCustomIdTests(unittest.TestCase):
+
+    def test_prompt_number_format(self):
+        # Formato que genera OpenAiBatchProcessor: {project}_{Path(doc_name).stem}_prompt{n}
+        self.assertEqual(_parse_custom_id('CFA1_INI-XXX_prompt2'), ('CFA1', 'INI-XXX', 'productos', None))
+
+    def test_prompt_number_format_with_chunk_document(self):
+        self.assertEqual(
+            _parse_custom_id('CFA1_INI-XXX_chunk_000_prompt1'),
+            ('CFA1', 'INI-XXX_chunk_000', 'auditoria', 'chunk_000')
+        )
+
+    def test_prompt_type_format(self):
+        self.assertEqual(_parse_custom_id('CFA1_IXP-001_auditoria'), ('CFA1', 'IXP-001', 'auditoria', None))
+
+    def test_prompt_type_format_with_chunk_suffix(self):
+        self.assertEqual(
+            _parse_custom_id('CFA1_ROP-002_desembolsos_chunk_003'),
+            ('CFA1', 'ROP-002_chunk_003', 'desembolsos', 'chunk_003')
+        )
+
+    def test_prompt_type_without_document(self):
+        self.assertEqual(_parse_custom_id('CFA1_auditoria'), ('CFA1', 'auditoria', 'auditoria', None))
+
+    def test_invalid_custom_id(self):
+        self.assertIsNone(_parse_custom_id('CFA1'))
+        self.assertEqual(_parse_custom_id('CFA1_INI-XXX'), ('CFA1', None, None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
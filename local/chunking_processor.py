@@ -1,6 +1,7 @@
 import re
 import tiktoken
 import json
+from functools import lru_cache
 from typing import List, Dict, Any, Tuple
 from pathlib import Path
 from datetime import datetime
@@ -12,6 +13,16 @@ from utils.app_insights_logger import get_logger
 logger = get_logger('chunking_processor')
 
 
+@lru_cache(maxsize=None)
+def _get_tokenizer(model_name: str) -> "tiktoken.Encoding":
+    """Encoding de tiktoken compartido por proceso (el vocabulario se parsea una sola vez)."""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # Fallback para modelos no reconocidos
+        return tiktoken.get_encoding("cl100k_base")
+
+
 class ChunkingProcessor:
     """Procesador de chunking para dividir documentos grandes en fragmentos manejables."""
     
@@ -31,12 +42,8 @@ class ChunkingProcessor:
         self.generate_jsonl = generate_jsonl
         self.jsonl_handler = JSONLHandler() if generate_jsonl else None
         
-        # Inicializar el tokenizer
-        try:
-            self.tokenizer = tiktoken.encoding_for_model(model_name)
-        except KeyError:
-            # Fallback para modelos no reconocidos
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        # Inicializar el tokenizer (compartido entre instancias del mismo proceso)
+        self.tokenizer = _get_tokenizer(model_name)
     
     def count_tokens(self, text: str) -> int:
         """Cuenta el número de tokens en un texto."""
@@ -281,7 +288,7 @@ class ChunkingProcessor:
         }
     
     def save_chunks(self, chunking_result: Dict[str, Any], output_dir: str = "local/output_docs") -> List[str]:
-        """Guarda los chunks en archivos separados y genera un archivo JSONL individual por cada chunk."""
+        """Guarda los chunks en archivos MD separados y genera un único corpus JSONL con un registro por chunk."""
         project_name = chunking_result['project_name']
         
         # Crear estructura de carpetas: local/output_docs/{project_name}/docs/ y agents_output/
@@ -293,6 +300,7 @@ class ChunkingProcessor:
         
         chunks = chunking_result['chunks']
         saved_files = []
+        jsonl_records = []
         
         for chunk in chunks:
             # Guardar chunk como archivo MD
@@ -316,46 +324,25 @@ class ChunkingProcessor:
             
             saved_files.append(str(chunk_filepath))
             
-            # Generar archivo JSONL individual para este chunk si está habilitado
             if self.generate_jsonl:
-                jsonl_record = self._create_jsonl_record(chunk, project_name, chunking_result)
-                
-                # Crear archivo JSONL individual para este chunk
-                chunk_jsonl_filename = f"corpus_chunk_{chunk['index']:03d}.jsonl"
-                chunk_jsonl_path = agents_output_path / chunk_jsonl_filename
-                
-                # Validar y escribir registro JSONL individual
-                success = self.jsonl_handler.write_jsonl(
-                    [jsonl_record],  # Solo un registro por archivo
-                    str(chunk_jsonl_path), 
-                    validate_func=validate_corpus_chunk
-                )
-                
-                if success:
-                    saved_files.append(str(chunk_jsonl_path))
-                    logger.info(f"Chunk JSONL generated: {chunk_jsonl_path}")
-                else:
-                    logger.error(f"Error generating chunk JSONL: {chunk_jsonl_path}")
-        
-        # También generar corpus JSONL completo para compatibilidad con documentos sin chunking
-        if self.generate_jsonl and len(chunks) > 1:
-            logger.info(f"\nGenerating complete corpus JSONL for compatibility...")
-            all_jsonl_records = []
-            for chunk in chunks:
-                jsonl_record = self._create_jsonl_record(chunk, project_name, chunking_result)
-                all_jsonl_records.append(jsonl_record)
-            
-            corpus_jsonl_path = agents_output_path / f"corpus_document_intelligence.jsonl"
+                jsonl_records.append(self._create_jsonl_record(chunk, project_name, chunking_result))
+        
+        # Corpus JSONL con todos los chunks, escrito de una vez (cada registro lleva su
+        # indice_chunk, así que no hace falta un archivo JSONL por chunk)
+        if self.generate_jsonl:
+            corpus_jsonl_path = agents_output_path / "corpus_document_intelligence.jsonl"
             success = self.jsonl_handler.write_jsonl(
-                all_jsonl_records, 
+                jsonl_records, 
                 str(corpus_jsonl_path), 
                 validate_func=validate_corpus_chunk
             )
             
             if success:
                 saved_files.append(str(corpus_jsonl_path))
-                logger.info(f"Complete corpus JSONL generated: {corpus_jsonl_path}")
-            logger.info(f"Total JSONL records: {len(all_jsonl_records)}")
+                logger.info(f"Corpus JSONL generated: {corpus_jsonl_path}")
+            else:
+                logger.error(f"Error generating corpus JSONL: {corpus_jsonl_path}")
+            logger.info(f"Total JSONL records: {len(jsonl_records)}")
         
         # Guardar metadatos del chunking en la carpeta docs
         metadata_file = docs_path / f"{project_name}_chunking_metadata.json"
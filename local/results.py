@@ -1,9 +1,12 @@
+import io
 import os
+import re
 import json
 import logging
 import time
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple, Union
 from datetime import datetime
+from collections import defaultdict
 from pathlib import Path
 from openai import AzureOpenAI
 from dotenv import load_dotenv
@@ -20,6 +23,46 @@ logging.getLogger('azure.core.pipeline.policies.http_logging_policy').setLevel(l
 logging.getLogger('azure').setLevel(logging.WARNING)
 logging.getLogger('openai').setLevel(logging.WARNING)
 
+try:
+    import orjson
+    # orjson.JSONDecodeError hereda de json.JSONDecodeError: los except existentes siguen valiendo
+    _json_loads = orjson.loads
+except ImportError:  # orjson es opcional: sin él se usa json estándar
+    _json_loads = json.loads
+
+# Tokens de tipo de prompt en los custom_id
+_PROMPT_TYPES = frozenset(('auditoria', 'desembolsos', 'productos'))
+
+# Bloque ```json embebido en texto libre (compilado una vez, no por cada respuesta)
+_JSON_BLOCK_RE = re.compile(r'```json\s*\n([\s\S]*?)\n```')
+
+# String JSON completo (o sin cerrar al final del texto) o una llave/corchete estructural
+_BALANCE_TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"?|[{}\[\]]', re.DOTALL)
+
+def _balance(text: str) -> Tuple[int, int]:
+    """
+    Cuenta en una sola pasada las llaves y corchetes que quedan abiertos en un texto JSON,
+    ignorando los que aparecen dentro de strings (incluidas comillas escapadas).
+    
+    Args:
+        text: Texto JSON posiblemente truncado
+        
+    Returns:
+        Tupla (llaves abiertas, corchetes abiertos)
+    """
+    open_braces = open_brackets = 0
+    # Los strings se consumen enteros en el regex; solo llegan llaves/corchetes estructurales
+    for token in _BALANCE_TOKEN_RE.findall(text):
+        if token == '{':
+            open_braces += 1
+        elif token == '}':
+            open_braces -= 1
+        elif token == '[':
+            open_brackets += 1
+        elif token == ']':
+            open_brackets -= 1
+    return open_braces, open_brackets
+
 class BatchResultsProcessor:
     """
     Procesador de resultados de Azure OpenAI Batch API.
@@ -198,7 +241,8 @@ class BatchResultsProcessor:
             self.logger.info(f"📥 Descargando resultados del batch {batch_id}...")
             
             file_response = self.client.files.content(output_file_id)
-            results_content = file_response.read().decode('utf-8')
+            # Se conservan los bytes: se guardan tal cual y cada línea se parsea sin decodificar a str
+            results_content = file_response.read()
             
             # Crear directorio para logs de OpenAI
             openai_logs_dir = os.path.join("local", "output_docs", project_name, "openai_logs")
@@ -208,7 +252,7 @@ class BatchResultsProcessor:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             raw_results_file = os.path.join(openai_logs_dir, f"batch_results_raw_{project_name}_{batch_id}_{timestamp}.jsonl")
             
-            with open(raw_results_file, 'w', encoding='utf-8') as f:
+            with open(raw_results_file, 'wb') as f:
                 f.write(results_content)
             
             self.logger.info(f"💾 Resultados raw guardados en: {raw_results_file}")
@@ -253,18 +297,18 @@ class BatchResultsProcessor:
             self.logger.warning(f"⚠️ Errores guardados en: {error_file}")
             
             # Contar errores
-            error_count = len([line for line in error_content.strip().split('\n') if line.strip()])
+            error_count = sum(1 for line in io.StringIO(error_content) if not line.isspace())
             self.logger.warning(f"⚠️ Total de errores encontrados: {error_count}")
             
         except Exception as e:
             self.logger.error(f"Error descargando archivo de errores: {str(e)}")
     
-    def _process_batch_results(self, results_content: str, project_name: str, batch_id: str) -> Dict[str, Any]:
+    def _process_batch_results(self, results_content: Union[str, bytes], project_name: str, batch_id: str) -> Dict[str, Any]:
         """
         Procesa los resultados del batch y los organiza por documento y prompt.
         
         Args:
-            results_content: Contenido JSONL de los resultados
+            results_content: Contenido JSONL de los resultados (str o bytes UTF-8)
             project_name: Nombre del proyecto
             batch_id: ID del batch
             
@@ -276,19 +320,27 @@ class BatchResultsProcessor:
             openai_logs_dir = os.path.join("local", "output_docs", project_name, "openai_logs")
             os.makedirs(openai_logs_dir, exist_ok=True)
             
-            results_by_document = {}
+            # Un solo acceso por nivel al insertar: {documento: {prompt: [resultados]}}
+            results_by_document = defaultdict(lambda: defaultdict(list))
             results_by_prompt = {"auditoria": [], "desembolsos": [], "productos": []}
             total_processed = 0
             successful_responses = 0
             failed_responses = 0
+            # Timestamp único para todos los resultados del batch
+            processed_at = datetime.now().isoformat()
             
-            # Procesar cada línea del JSONL
-            for line in results_content.strip().split('\n'):
-                if not line.strip():
+            # Codificar una sola vez: orjson parsea bytes directamente
+            if isinstance(results_content, str):
+                results_content = results_content.encode('utf-8')
+
+            # Recorrer el JSONL línea a línea sin materializar la lista completa de líneas
+            # (las líneas vacías se omiten, así que no hace falta un strip() previo)
+            for line in io.BytesIO(results_content):
+                if not line or line.isspace():
                     continue
                 
                 try:
-                    result = json.loads(line)
+                    result = _json_loads(line)
                     total_processed += 1
                     
                     custom_id = result.get('custom_id', '')
@@ -296,7 +348,7 @@ class BatchResultsProcessor:
                     
                     if response.get('status_code') == 200:
                         successful_responses += 1
-                        self._process_successful_response(result, results_by_document, results_by_prompt)
+                        self._process_successful_response(result, results_by_document, results_by_prompt, processed_at)
                     else:
                         failed_responses += 1
                         self.logger.warning(f"⚠️ Respuesta fallida para {custom_id}: {response.get('status_code')}")
@@ -324,15 +376,21 @@ class BatchResultsProcessor:
             
             # Extraer y guardar contenido por tipo de prompt
             prompt_files = {}
+            # Respuestas idénticas (reintentos, prompts duplicados) se parsean una sola vez
+            parsed_cache: Dict[str, Any] = {}
+
+            def _parse_cached(content: Any) -> Any:
+                # Contenido ya estructurado (p.ej. salidas en modo JSON): no hay nada que parsear
+                if not isinstance(content, str):
+                    return content
+                if content not in parsed_cache:
+                    parsed_cache[content] = self._extract_json_content(content)
+                return parsed_cache[content]
+
             for prompt_type, results in results_by_prompt.items():
                 if results:  # Solo procesar si hay resultados
                     # Extraer solo el contenido de cada resultado
-                    content_list = []
-                    for result in results:
-                        if result.get('content'):
-                            content = result['content']
-                            parsed_content = self._extract_json_content(content)
-                            content_list.append(parsed_content)
+                    content_list = [_parse_cached(result['content']) for result in results if result.get('content')]
                     
                     # Guardar archivo separado por prompt
                     prompt_filename = f"{prompt_type}.json"
@@ -348,7 +406,7 @@ class BatchResultsProcessor:
             summary = {
                 "project_name": project_name,
                 "batch_id": batch_id,
-                "processed_at": datetime.now().isoformat(),
+                "processed_at": processed_at,
                 "statistics": {
                     "total_processed": total_processed,
                     "successful_responses": successful_responses,
@@ -371,20 +429,22 @@ class BatchResultsProcessor:
             with open(summary_file, 'w', encoding='utf-8') as f:
                 json.dump(summary, f, indent=2, ensure_ascii=False)
             
-            # Log resumen
-            self.logger.info(f"📊 Procesamiento completado:")
-            self.logger.info(f"   📄 Total procesadas: {total_processed}")
-            self.logger.info(f"   ✅ Exitosas: {successful_responses}")
-            self.logger.info(f"   ❌ Fallidas: {failed_responses}")
-            self.logger.info(f"   📈 Tasa de éxito: {summary['statistics']['success_rate']:.1f}%")
-            self.logger.info(f"   📁 Archivos generados:")
-            self.logger.info(f"      📋 Por documento: {documents_file}")
-            self.logger.info(f"      🎯 Por prompt: {prompts_file}")
-            self.logger.info(f"      📊 Resumen: {summary_file}")
+            # Log resumen en un único registro
+            summary_lines = [
+                f"📊 Procesamiento completado:",
+                f"   📄 Total procesadas: {total_processed}",
+                f"   ✅ Exitosas: {successful_responses}",
+                f"   ❌ Fallidas: {failed_responses}",
+                f"   📈 Tasa de éxito: {summary['statistics']['success_rate']:.1f}%",
+                f"   📁 Archivos generados:",
+                f"      📋 Por documento: {documents_file}",
+                f"      🎯 Por prompt: {prompts_file}",
+                f"      📊 Resumen: {summary_file}"
+            ]
             if prompt_files:
-                self.logger.info(f"      🗂️ Archivos separados por prompt:")
-                for prompt_type, filepath in prompt_files.items():
-                    self.logger.info(f"         {prompt_type}: {filepath}")
+                summary_lines.append(f"      🗂️ Archivos separados por prompt:")
+                summary_lines.extend(f"         {prompt_type}: {filepath}" for prompt_type, filepath in prompt_files.items())
+            self.logger.info("\n".join(summary_lines))
             
             return summary
             
@@ -405,38 +465,30 @@ class BatchResultsProcessor:
             
         # Caso 1: Contenido en bloque de código ```json
         if content.startswith('```json\n'):
-            # Manejar diferentes terminaciones: \n```, \n```\n, etc.
-            if content.endswith('\n```'):
-                json_content = content[8:-4]  # Remover ```json\n y \n```
-            elif content.endswith('\n```\n'):
-                json_content = content[8:-5]  # Remover ```json\n y \n```\n
-            elif content.endswith('```'):
-                json_content = content[8:-3]  # Remover ```json\n y ```
+            # Un único rfind cubre todas las terminaciones (\n```, \n```\n, ```); si no hay
+            # cierre del bloque el JSON está posiblemente truncado
+            end_pos = content.rfind('```')
+            if end_pos > 8:
+                json_content = content[8:end_pos].rstrip('\n')
             else:
-                # Buscar el final del bloque o manejar JSON truncado
-                end_pos = content.rfind('```')
-                if end_pos > 8:
-                    json_content = content[8:end_pos].rstrip('\n')
-                else:
-                    # JSON posiblemente truncado - intentar reparar
-                    json_content = content[8:]  # Remover ```json\n
-                    # Si termina de forma incompleta, intentar completar
-                    if not json_content.rstrip().endswith(('}', ']')):
-                        # Contar llaves/corchetes para intentar cerrar
-                        open_braces = json_content.count('{') - json_content.count('}')
-                        open_brackets = json_content.count('[') - json_content.count(']')
-                        
-                        # Intentar cerrar las estructuras abiertas
-                        if open_braces > 0 or open_brackets > 0:
-                            json_content = json_content.rstrip()
-                            # Remover comas finales
-                            if json_content.endswith(','):
-                                json_content = json_content[:-1]
-                            # Cerrar estructuras
-                            json_content += '}' * open_braces + ']' * open_brackets
+                # JSON posiblemente truncado - intentar reparar
+                json_content = content[8:]  # Remover ```json\n
+                # Si termina de forma incompleta, intentar completar
+                if not json_content.rstrip().endswith(('}', ']')):
+                    # Contar llaves/corchetes abiertos en una sola pasada
+                    open_braces, open_brackets = _balance(json_content)
+                    
+                    # Intentar cerrar las estructuras abiertas
+                    if open_braces > 0 or open_brackets > 0:
+                        json_content = json_content.rstrip()
+                        # Remover comas finales
+                        if json_content.endswith(','):
+                            json_content = json_content[:-1]
+                        # Cerrar estructuras
+                        json_content += '}' * open_braces + ']' * open_brackets
             
             try:
-                return json.loads(json_content)
+                return _json_loads(json_content)
             except json.JSONDecodeError as e:
                 self.logger.warning(f"No se pudo parsear JSON del bloque de código: {str(e)[:100]}")
                 return content
@@ -445,25 +497,55 @@ class BatchResultsProcessor:
         content_stripped = content.strip()
         if content_stripped.startswith(('{', '[')):
             try:
-                return json.loads(content_stripped)
+                return _json_loads(content_stripped)
             except json.JSONDecodeError:
                 self.logger.warning(f"No se pudo parsear JSON directo")
                 return content
         
         # Caso 3: Buscar JSON dentro del texto
-        import re
-        json_pattern = r'```json\s*\n([\s\S]*?)\n```'
-        match = re.search(json_pattern, content)
+        match = _JSON_BLOCK_RE.search(content)
         if match:
             try:
-                return json.loads(match.group(1))
+                return _json_loads(match.group(1))
             except json.JSONDecodeError:
                 self.logger.warning(f"No se pudo parsear JSON encontrado en el texto")
         
         # Si no se puede parsear de ninguna manera, devolver el contenido original
         return content
 
-    def _process_successful_response(self, result: Dict[str, Any], results_by_document: Dict, results_by_prompt: Dict):
+    @staticmethod
+    def _split_custom_id(parts: List[str]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """
+        Decodifica los tokens de un custom_id {project}_{document}_{prompt_type}[_chunk_{num}]
+        en una sola pasada, sin búsquedas de substrings ni replace. El sufijo _chunk_ se separa del
+        nombre del documento tanto después del prompt como dentro del documento ({document} = X_chunk_{num}).
+        
+        Args:
+            parts: custom_id separado por '_'
+            
+        Returns:
+            Tupla (prompt_type, document_name, chunk_info); (None, None, None) sin token de prompt
+        """
+        # Buscar el token de prompt desde el final (el nombre del documento puede contener '_')
+        for idx in range(len(parts) - 1, 0, -1):
+            if parts[idx] in _PROMPT_TYPES:
+                break
+        else:
+            return None, None, None
+        
+        # Los sufijos tras el prompt forman parte del nombre del documento; sin documento antes
+        # del prompt se conserva el resto del custom_id
+        document_name = '_'.join(parts[1:idx] + parts[idx + 1:]) if idx > 1 else '_'.join(parts[1:])
+        chunk_info = None
+        if '_chunk_' in document_name:
+            chunk_parts = document_name.split('_chunk_')
+            if len(chunk_parts) == 2:
+                document_name = chunk_parts[0]
+                chunk_info = f"chunk_{chunk_parts[1]}"
+        return parts[idx], document_name, chunk_info
+
+    def _process_successful_response(self, result: Dict[str, Any], results_by_document: Dict, results_by_prompt: Dict,
+                                     processed_at: str):
         """
         Procesa una respuesta exitosa y la organiza en las estructuras de datos.
         
@@ -471,6 +553,7 @@ class BatchResultsProcessor:
             result: Resultado individual del batch
             results_by_document: Dict para organizar por documento
             results_by_prompt: Dict para organizar por prompt
+            processed_at: Timestamp ISO del batch
         """
         try:
             custom_id = result.get('custom_id', '')
@@ -484,36 +567,19 @@ class BatchResultsProcessor:
                 self.logger.warning(f"⚠️ Formato de custom_id inválido: {custom_id}")
                 return
             
-            project_name = parts[0]
-            prompt_type = None
-            document_name = None
-            chunk_info = None
-            
-            # Identificar prompt type y document name
-            if 'auditoria' in custom_id:
-                prompt_type = 'auditoria'
-                document_name = custom_id.replace(f"{project_name}_", "").replace("_auditoria", "")
-            elif 'desembolsos' in custom_id:
-                prompt_type = 'desembolsos'
-                document_name = custom_id.replace(f"{project_name}_", "").replace("_desembolsos", "")
-            elif 'productos' in custom_id:
-                prompt_type = 'productos'
-                document_name = custom_id.replace(f"{project_name}_", "").replace("_productos", "")
-            
-            # Extraer información de chunk si existe
-            if '_chunk_' in document_name:
-                chunk_match = document_name.split('_chunk_')
-                if len(chunk_match) == 2:
-                    document_name = chunk_match[0]
-                    chunk_info = f"chunk_{chunk_match[1]}"
+            # Identificar prompt type, document name y chunk
+            prompt_type, document_name, chunk_info = self._split_custom_id(parts)
             
             # Extraer contenido de la respuesta
-            choices = body.get('choices', [])
-            if not choices:
-                self.logger.warning(f"⚠️ No hay choices en la respuesta para {custom_id}")
-                return
-            
-            content = choices[0].get('message', {}).get('content', '')
+            # Acceso directo en el caso habitual, sin construir dicts por defecto en cada resultado
+            try:
+                content = body['choices'][0]['message']['content']
+            except (KeyError, IndexError, TypeError):
+                if not body.get('choices'):
+                    self.logger.warning(f"⚠️ No hay choices en la respuesta para {custom_id}")
+                    return
+                # Choice sin message/content
+                content = ''
             
             # Crear estructura de resultado
             result_data = {
@@ -523,21 +589,16 @@ class BatchResultsProcessor:
                 "chunk_info": chunk_info,
                 "content": content,
                 "usage": body.get('usage', {}),
-                "processed_at": datetime.now().isoformat()
+                "processed_at": processed_at
             }
             
             # Organizar por documento
-            if document_name not in results_by_document:
-                results_by_document[document_name] = {}
-            
-            if prompt_type not in results_by_document[document_name]:
-                results_by_document[document_name][prompt_type] = []
-            
             results_by_document[document_name][prompt_type].append(result_data)
             
-            # Organizar por prompt
-            if prompt_type in results_by_prompt:
-                results_by_prompt[prompt_type].append(result_data)
+            # Organizar por prompt (un solo acceso al dict)
+            prompt_bucket = results_by_prompt.get(prompt_type)
+            if prompt_bucket is not None:
+                prompt_bucket.append(result_data)
             
         except Exception as e:
             self.logger.error(f"Error procesando respuesta exitosa {result.get('custom_id', 'unknown')}: {str(e)}")
@@ -3,6 +3,8 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Any, Callable, Optional
 
+_WRITE_BUFFER_SIZE = 256 * 1024
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -29,7 +31,8 @@ class JSONLHandler:
             # Crear directorio padre si no existe
             Path(file_path).parent.mkdir(parents=True, exist_ok=True)
             
-            with open(file_path, 'w', encoding='utf-8') as f:
+            # Búfer amplio: un corpus de chunks son pocas líneas muy largas
+            with open(file_path, 'w', encoding='utf-8', buffering=_WRITE_BUFFER_SIZE) as f:
                 for record in records:
                     # Validar registro si se proporciona función de validación
                     if validate_func: